@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+    End-to-end benchmark of the offline part of srcup on a synthetic Hardhat project: build-info parsing
+    (`build.get_extra_fields`), extraction (`extract.process`), source-map remapping and payload serialization.
+    Needs neither solc, node nor network access.
+
+    Results are written as stable JSON (sorted keys, one entry per benchmark) so that runs on different commits
+    can be compared:
+
+        python benchmarks/bench_pipeline.py --json before.json
+        git checkout <other commit>
+        python benchmarks/bench_pipeline.py --compare before.json --max-ratio 1.2
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from srcup import srcmap
+from srcup.build import get_extra_fields, ijson
+from srcup.extract import generate_remapping, get_referenced_sources, process, remap_srcmap
+from srcup.models import PayloadFormat
+from srcup.payload import PayloadSpool, build_source_table, iter_json, msgpack, serialize, spool_records
+from synthetic import synthetic_project
+
+FORMAT_VERSION = 1
+
+
+def measure(fn: Callable[[], Any], runs: int) -> dict[str, float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "runs": runs}
+
+
+def drain(chunks) -> int:
+    return sum(len(chunk) for chunk in chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--units", type=int, default=4, help="Compilation units (and build-info files)")
+    parser.add_argument("--files", type=int, default=25, help="Source files per compilation unit")
+    parser.add_argument("--contracts", type=int, default=2, help="Contracts per source file")
+    parser.add_argument("--srcmap-entries", type=int, default=8000)
+    parser.add_argument("--bytecode-size", type=int, default=12000, help="Runtime bytecode size in bytes")
+    parser.add_argument("--jobs", type=int, default=1, help="Also benchmark the parallel code paths with this many workers")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--only", help="Only run the benchmarks whose name contains this string")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Results of a previous run to compare against")
+    parser.add_argument("--max-ratio", type=float, help="With --compare, exit with an error if any benchmark got slower than this")
+    args = parser.parse_args()
+
+    params = {
+        "units": args.units, "files": args.files, "contracts": args.contracts,
+        "srcmap_entries": args.srcmap_entries, "bytecode_size": args.bytecode_size,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        print("Generating the synthetic project...", file=sys.stderr)
+        artifact = synthetic_project(
+            root, args.units, args.files, args.contracts, args.srcmap_entries, args.bytecode_size,
+        )
+        build_directory = root / "artifacts" / "build-info"
+
+        extra_fields = get_extra_fields(artifact, str(root), build_directory, str(root), True)
+        records = process(artifact, extra_fields, True, True, True)
+        sources, bytecode, ir_code, init_code = (list(column) for column in zip(*records))
+        fields = {"sources": sources, "bytecode": bytecode, "ir_code": ir_code, "init_code": init_code}
+        dedup_sources, source_table = build_source_table(sources)
+        dedup_fields = {**fields, "sources": dedup_sources, "source_table": source_table}
+
+        src_maps = [
+            (source_unit.srcmap_runtime(name), frozenset(str(i) for i in range(args.files)))
+            for unit in artifact.compilation_units.values()
+            for source_unit in unit.source_units.values()
+            for name in source_unit.contracts_names
+        ]
+
+        def split_join():
+            for src_map, file_ids in src_maps:
+                references = get_referenced_sources(src_map)
+                ";".join(remap_srcmap(src_map, generate_remapping(references, file_ids)))
+
+        def srcmap_engine():
+            srcmap._remap_cache.clear()
+            for src_map, file_ids in src_maps:
+                srcmap.remap_source_map(";".join(src_map), file_ids)
+
+        def extract(jobs: int = 1):
+            # Source maps are memoized across runs otherwise
+            srcmap._remap_cache.clear()
+            process(artifact, extra_fields, True, True, True, None, jobs)
+
+        def spool(payload_format: PayloadFormat):
+            with PayloadSpool(payload_format) as spooled:
+                columns, _ = spool_records(iter(records), spooled, True)
+                drain(serialize(columns, payload_format))
+
+        benchmarks: dict[str, Callable[[], Any]] = {
+            "build.get_extra_fields": lambda: get_extra_fields(artifact, str(root), build_directory, str(root), True),
+            "extract.process": extract,
+            "srcmap.split_join": split_join,
+            "srcmap.engine": srcmap_engine,
+            "payload.json": lambda: drain(iter_json(fields)),
+            "payload.json_dedup_sources": lambda: drain(iter_json(dedup_fields)),
+            "payload.spool_json": lambda: spool(PayloadFormat.JSON),
+        }
+        if msgpack is not None:
+            benchmarks["payload.msgpack"] = lambda: drain(serialize(fields, PayloadFormat.MSGPACK))
+            benchmarks["payload.spool_msgpack"] = lambda: spool(PayloadFormat.MSGPACK)
+        if args.jobs > 1:
+            benchmarks[f"build.get_extra_fields[jobs={args.jobs}]"] = lambda: get_extra_fields(
+                artifact, str(root), build_directory, str(root), True, args.jobs
+            )
+            benchmarks[f"extract.process[jobs={args.jobs}]"] = lambda: extract(args.jobs)
+
+        results: dict[str, dict] = {}
+        for name, fn in benchmarks.items():
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(fn, args.runs)
+            print(f"{name:<40} median {results[name]['median_s'] * 1000:9.1f} ms   min {results[name]['min_s'] * 1000:9.1f} ms")
+
+        sizes = {
+            "contracts": len(records),
+            "payload_json_bytes": drain(iter_json(fields)),
+            "build_info_bytes": sum(f.stat().st_size for f in build_directory.iterdir()),
+        }
+
+    output = {
+        "format": FORMAT_VERSION,
+        "params": params,
+        "sizes": sizes,
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "ijson": ijson is not None},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print("WARNING: the baseline was run with different parameters", file=sys.stderr)
+
+        regressions = []
+        print(f"\n{'benchmark':<40} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+        for name, result in results.items():
+            if (before := baseline.get("results", {}).get(name)) is None:
+                continue
+            ratio = result["median_s"] / before["median_s"]
+            print(f"{name:<40} {before['median_s'] * 1000:>12.1f} {result['median_s'] * 1000:>12.1f} {ratio:>7.2f}")
+            if args.max_ratio is not None and ratio > args.max_ratio:
+                regressions.append(name)
+
+        if regressions:
+            print(f"Slower than {args.max_ratio}x the baseline: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+    Source-map remapping micro-benchmark: compares the per-entry split/join implementation with `srcup.srcmap`,
+    cold and memoized, on synthetic compressed source maps of real-world sizes, and checks they agree.
+
+    Usage: python benchmarks/bench_srcmap.py [--entries N ...] [--runs N] [--json out.json]
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from srcup.extract import generate_remapping, get_referenced_sources, remap_srcmap
+from srcup import srcmap
+from synthetic import synthetic_srcmap
+
+
+def split_join(src_map: list[str], file_ids: set[str]) -> tuple[list[str], str]:
+    references = get_referenced_sources(src_map)
+    remapping = generate_remapping(references, file_ids)
+    return references, ";".join(remap_srcmap(src_map, remapping))
+
+
+def engine(src_map: list[str], file_ids: frozenset[str]) -> tuple[list[str], str]:
+    return srcmap.remap_source_map(";".join(src_map), file_ids)
+
+
+def cold_engine(src_map: list[str], file_ids: frozenset[str]) -> tuple[list[str], str]:
+    srcmap._remap_cache.clear()
+    return engine(src_map, file_ids)
+
+
+def measure(fn, src_map: list[str], file_ids, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(src_map, file_ids)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--files", type=int, default=120, help="Number of source files referenced")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for entries in args.entries:
+        src_map = synthetic_srcmap(entries, args.files)
+        # Some of the referenced files are not part of the compilation unit, and get remapped to -1
+        file_ids = {str(i) for i in range(args.files) if i % 7}
+
+        if split_join(src_map, file_ids) != cold_engine(src_map, frozenset(file_ids)):
+            raise SystemExit(f"Mismatch between the implementations on {entries} entries")
+
+        result = {
+            "entries": entries,
+            "split_join_s": measure(split_join, src_map, file_ids, args.runs),
+            "engine_cold_s": measure(cold_engine, src_map, frozenset(file_ids), args.runs),
+            "engine_cached_s": measure(engine, src_map, frozenset(file_ids), args.runs),
+        }
+        results.append(result)
+        print(
+            f"{entries:>7} entries   split/join {result['split_join_s'] * 1000:8.2f} ms   "
+            f"engine {result['engine_cold_s'] * 1000:8.2f} ms   cached {result['engine_cached_s'] * 1000:8.2f} ms"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
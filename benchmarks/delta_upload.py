@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+    Delta upload check: uploads a synthetic project to the local API stand-in (`srcup.standin`), then uploads the
+    same build again as a new version with `--delta`, and checks that the second upload only sends a small share of
+    the bytes of the first one. Needs neither solc, node nor network access.
+
+    Usage: python benchmarks/delta_upload.py [--max-ratio 0.02] [--payload-format json|msgpack] [--json out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import cast
+
+from aiohttp import web
+from crytic_compile.crytic_compile import CryticCompile
+
+from srcup.api import DedaubClient
+from srcup.build import get_extra_fields
+from srcup.extract import process
+from srcup.models import ContentEncoding, PayloadFormat
+from srcup.payload import PayloadSpool, spool_records
+from srcup.standin import make_app
+from synthetic import synthetic_project
+
+
+async def upload_twice(root: Path, args: argparse.Namespace) -> tuple[int, int, int]:
+    # Duck-types the parts of CryticCompile that srcup reads
+    artifact = cast(CryticCompile, synthetic_project(
+        root, args.units, args.files, args.contracts, args.srcmap_entries, args.bytecode_size
+    ))
+    extra_fields = get_extra_fields(artifact, str(root), root / "artifacts" / "build-info", str(root), True)
+    records = process(artifact, extra_fields, True, True, True)
+
+    app = make_app()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", args.port)
+    await site.start()
+    requests = app["standin"].requests
+
+    try:
+        payload_format = PayloadFormat(args.payload_format)
+        with PayloadSpool(payload_format) as spool:
+            columns, _ = spool_records(iter(records), spool, True)
+            upload = (
+                columns["sources"], columns["bytecode"], columns["ir_code"], columns["init_code"], "00" * 20
+            )
+            async with DedaubClient(f"http://localhost:{args.port}", "test", payload_format=payload_format) as client:
+                await client.create_project(
+                    "delta", "", *upload, "", None, {}, columns["source_table"], ContentEncoding.IDENTITY
+                )
+                full = sum(size for _, _, size in requests)
+                requests.clear()
+                await client.update_project(
+                    "", "delta", "", *upload, {}, columns["source_table"], ContentEncoding.IDENTITY, delta=True
+                )
+                delta = sum(size for _, _, size in requests)
+    finally:
+        await runner.cleanup()
+
+    return len(records), full, delta
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--units", type=int, default=2, help="Compilation units (and build-info files)")
+    parser.add_argument("--files", type=int, default=10, help="Source files per compilation unit")
+    parser.add_argument("--contracts", type=int, default=2, help="Contracts per source file")
+    parser.add_argument("--srcmap-entries", type=int, default=8000)
+    parser.add_argument("--bytecode-size", type=int, default=12000, help="Runtime bytecode size in bytes")
+    parser.add_argument("--payload-format", choices=[f.value for f in PayloadFormat], default=PayloadFormat.JSON.value)
+    parser.add_argument("--port", type=int, default=8089, help="Port of the stand-in API")
+    parser.add_argument("--max-ratio", type=float, default=0.02, help="Largest accepted share of the full upload size")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        contracts, full, delta = asyncio.run(upload_twice(Path(tmp), args))
+
+    ratio = delta / full
+    print(f"{contracts} contracts   full upload {full / 1e6:8.2f} MB   unchanged --delta upload {delta / 1e6:8.3f} MB   ratio {ratio:.4f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"contracts": contracts, "full_bytes": full, "delta_bytes": delta, "ratio": ratio}, f, indent=2)
+
+    if ratio > args.max_ratio:
+        print(f"An unchanged --delta upload sent more than {args.max_ratio} of the full upload", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
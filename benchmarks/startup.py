@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+    Startup benchmark: times `srcup --help` and `srcup --version` in fresh interpreters and checks
+    that none of the heavy dependencies get imported on those paths.
+
+    Usage: python benchmarks/startup.py [--runs N] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = {
+    "help": ["--help"],
+    "version": ["--version"],
+}
+
+# Only needed once srcup actually compiles, extracts or uploads something
+HEAVY_MODULES = ["crytic_compile", "pydantic", "aiohttp", "eth_hash", "dotenv"]
+
+IMPORT_CHECK = (
+    "import sys, srcup.cli; "
+    f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+)
+
+
+def run(args: list[str], runs: int) -> dict[str, float]:
+    env = {**os.environ, "SRCUP_NO_VERSION_CHECK": "1"}
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "srcup", *args], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "runs": runs}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results: dict = {name: run(cmd, args.runs) for name, cmd in COMMANDS.items()}
+
+    loaded = subprocess.run([sys.executable, "-c", IMPORT_CHECK], capture_output=True, text=True).stdout.strip()
+    results["heavy_modules_at_import"] = [m for m in loaded.split(",") if m]
+
+    for name in COMMANDS:
+        print(f"srcup --{name:<8} median {results[name]['median_s'] * 1000:7.1f} ms   min {results[name]['min_s'] * 1000:7.1f} ms")
+    print(f"heavy modules imported by srcup.cli: {', '.join(results['heavy_modules_at_import']) or 'none'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if results["heavy_modules_at_import"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+    Synthetic inputs for the benchmarks: stand-ins for the CryticCompile objects srcup reads, and matching
+    Hardhat build-info files on disk. Everything is generated from a seed, no compiler, node or network is needed.
+"""
+
+import json
+import os
+import random
+from pathlib import Path
+from typing import Any
+
+from crytic_compile.platform.types import Type
+
+
+def synthetic_srcmap(entries: int, files: int, seed: int = 0) -> list[str]:
+    # Mostly compressed entries, like solc emits: unchanged fields are left empty and trailing ones omitted
+    rng = random.Random(seed)
+    src_map = [f"0:{rng.randrange(100, 5000)}:0:-:0"]
+    for _ in range(entries - 1):
+        kind = rng.random()
+        if kind < 0.35:
+            src_map.append("")
+        elif kind < 0.65:
+            src_map.append(f"{rng.randrange(0, 50000)}:{rng.randrange(1, 500)}")
+        elif kind < 0.9:
+            src_map.append(f"{rng.randrange(0, 50000)}:{rng.randrange(1, 500)}:{rng.randrange(-1, files)}")
+        else:
+            src_map.append(f"{rng.randrange(0, 50000)}:{rng.randrange(1, 500)}:{rng.randrange(-1, files)}:{rng.choice('io-')}:0")
+    return src_map
+
+
+def synthetic_abi(functions: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    types = ["uint256", "address", "bool", "bytes32", "string", "uint8[]", "bytes"]
+    abi: list[dict] = []
+    for i in range(functions):
+        inputs: list[dict[str, Any]] = [{"name": f"a{j}", "type": rng.choice(types)} for j in range(rng.randrange(0, 4))]
+        if rng.random() < 0.2:
+            inputs.append({"name": "t", "type": "tuple[]", "components": [{"name": "x", "type": "uint256"}, {"name": "y", "type": "address"}]})
+        abi.append({"type": "function", "name": f"fn{i}", "inputs": inputs, "outputs": [], "stateMutability": "nonpayable"})
+    for i in range(max(1, functions // 6)):
+        abi.append({"type": "event", "name": f"Ev{i}", "inputs": [{"name": "a", "type": "address", "indexed": True}], "anonymous": False})
+        abi.append({"type": "error", "name": f"Err{i}", "inputs": [{"name": "c", "type": "uint256"}]})
+    return abi
+
+
+class FakeFilename:
+    def __init__(self, short: str, absolute: str):
+        self.short = short
+        self.absolute = absolute
+
+
+class FakeSourceUnit:
+    def __init__(self, file_id: int, filename: FakeFilename, contracts: dict[str, dict]):
+        self.filename = filename
+        self.ast = {"src": f"0:{1000 + file_id}:{file_id}", "nodeType": "SourceUnit"}
+        self.contracts_names = list(contracts)
+        self.libraries: dict[str, list] = {name: [] for name in contracts}
+        self.contracts = contracts
+
+    def bytecode_runtime(self, name: str, libraries=None) -> str:
+        return self.contracts[name]["bytecode"]
+
+    def bytecode_init(self, name: str, libraries=None) -> str:
+        return self.contracts[name]["init"]
+
+    def srcmap_runtime(self, name: str) -> list[str]:
+        return self.contracts[name]["srcmap"]
+
+    def abi(self, name: str) -> list[dict]:
+        return self.contracts[name]["abi"]
+
+
+class FakeCompilerVersion:
+    compiler = "solc"
+
+
+class FakeCompilationUnit:
+    def __init__(self, source_units: dict[str, FakeSourceUnit]):
+        self.source_units = source_units
+        self.compiler_version = FakeCompilerVersion()
+
+
+class FakePlatform:
+    TYPE = Type.HARDHAT
+    NAME = "Hardhat"
+
+
+class FakeCryticCompile:
+    def __init__(self, root: Path, compilation_units: dict[str, FakeCompilationUnit], src_content: dict[str, str]):
+        self.target = str(root)
+        self.working_dir = root
+        self.package_name = None
+        self.platform = FakePlatform()
+        self.compilation_units = compilation_units
+        self.src_content = src_content
+
+
+def synthetic_project(
+    root: Path,
+    units: int = 4,
+    files: int = 25,
+    contracts: int = 2,
+    srcmap_entries: int = 8000,
+    bytecode_size: int = 12000,
+    abi_functions: int = 30,
+    ir: bool = True,
+    seed: int = 0,
+) -> FakeCryticCompile:
+    """
+        Writes the sources and a Hardhat `artifacts/` tree (build-info and .dbg.json files) under `root`, and returns
+        the matching fake CryticCompile. Compilation units share half of their files, like projects that compile
+        the same libraries with several solc versions.
+    """
+    rng = random.Random(seed)
+    build_info_dir = root / "artifacts" / "build-info"
+    build_info_dir.mkdir(parents=True, exist_ok=True)
+
+    compilation_units: dict[str, FakeCompilationUnit] = {}
+    src_content: dict[str, str] = {}
+
+    for unit in range(units):
+        source_units: dict[str, FakeSourceUnit] = {}
+        output_sources: dict[str, dict] = {}
+        output_contracts: dict[str, dict] = {}
+        input_sources: dict[str, dict] = {}
+
+        for file_id in range(files):
+            shared = file_id < files // 2
+            short = f"contracts/{'lib' if shared else f'u{unit}'}/F{file_id}.sol"
+            absolute = root / short
+            if str(absolute) not in src_content:
+                absolute.parent.mkdir(parents=True, exist_ok=True)
+                content = f"// SPDX-License-Identifier: MIT\npragma solidity ^0.8.0;\n" + f"// {short}\n" * (bytecode_size // 40)
+                absolute.write_text(content)
+                src_content[str(absolute)] = content
+
+            unit_contracts: dict[str, dict] = {}
+            for index in range(contracts):
+                name = f"C{file_id}_{index}"
+                contract_seed = rng.randrange(1 << 32)
+                bytecode = random.Random(contract_seed).randbytes(bytecode_size).hex()
+                unit_contracts[name] = {
+                    "bytecode": bytecode,
+                    "init": bytecode[:2000] + bytecode,
+                    "srcmap": synthetic_srcmap(srcmap_entries, files, contract_seed),
+                    "abi": synthetic_abi(abi_functions, contract_seed),
+                }
+                output_contracts.setdefault(short, {})[name] = {
+                    "abi": unit_contracts[name]["abi"],
+                    "evm": {
+                        "deployedBytecode": {
+                            "object": bytecode,
+                            "sourceMap": ";".join(unit_contracts[name]["srcmap"]),
+                            "immutableReferences": {str(1000 + index): [{"start": 10, "length": 32}]},
+                            "functionDebugData": {
+                                f"@fn{i}_{i}": {"entryPoint": i * 17, "id": i, "parameterSlots": 2, "returnSlots": 1}
+                                for i in range(abi_functions)
+                            },
+                        },
+                    },
+                    **({"irOptimized": "object \"X\" { code { } }\n" * (bytecode_size // 200)} if ir else {}),
+                }
+
+            source_units[short] = FakeSourceUnit(file_id, FakeFilename(short, str(absolute)), unit_contracts)
+            input_sources[short] = {"content": src_content[str(absolute)]}
+            output_sources[short] = {"id": file_id, "ast": {"nodeType": "SourceUnit", "nodes": [{"id": i} for i in range(200)]}}
+
+        compilation_units[f"unit{unit}"] = FakeCompilationUnit(source_units)
+
+        build_info_name = f"{unit:032x}.json"
+        build_info = {
+            "_format": "hh-sol-build-info-1",
+            "solcVersion": "0.8.20",
+            "input": {"language": "Solidity", "sources": input_sources, "settings": {}},
+            "output": {"sources": output_sources, "contracts": output_contracts},
+        }
+        with open(build_info_dir / build_info_name, "w") as f:
+            json.dump(build_info, f)
+        # Stable oldest-first order for get_extra_fields
+        os.utime(build_info_dir / build_info_name, (1_700_000_000 + unit, 1_700_000_000 + unit))
+
+        for short, contracts_of_file in output_contracts.items():
+            artifact_dir = root / "artifacts" / short
+            artifact_dir.mkdir(parents=True, exist_ok=True)
+            for name in contracts_of_file:
+                with open(artifact_dir / f"{name}.dbg.json", "w") as f:
+                    json.dump({"_format": "hh-sol-dbg-1", "buildInfo": os.path.relpath(build_info_dir / build_info_name, artifact_dir)}, f)
+
+    return FakeCryticCompile(root, compilation_units, src_content)
@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 
-from srcup.cli import app
-from srcup.utils import create_config_dir, load_envfile, check_version
+import sys
+
+from srcup.cli import app, SUBCOMMANDS
+from srcup.utils import create_config_dir, load_envfile, start_version_check, check_version
 
 
 def main():
     create_config_dir()
     load_envfile()
-    check_version()
-    app()
+    start_version_check()
+    try:
+        if len(sys.argv) > 1 and (subcommand := SUBCOMMANDS.get(sys.argv[1])) is not None:
+            subcommand(args=sys.argv[2:], prog_name=f"srcup {sys.argv[1]}")
+        else:
+            app()
+    finally:
+        check_version()
 
 
 if __name__ == "__main__":
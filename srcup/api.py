@@ -1,61 +1,304 @@
 #!/usr/bin/env python3
 
-from typing import Any
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+from typing import Any, Callable
 import aiohttp
-from pydantic import ConfigDict, BaseModel
-
-from srcup.models import ContractBytecode, ContractInitCode, ContractSource, HexString, YulIRCode
-
-
-async def create_project(
-    watchdog_api: str,
-    api_key: str,
-    name: str,
-    comment: str,
-    sources: list[ContractSource],
-    bytecode: list[ContractBytecode],
-    ir_code: list[YulIRCode | None],
-    init_code: list[ContractInitCode | None],
-    git_hash: HexString,
-    organization: str,
-    entity_id: int | None,
-    metadata: dict[str, Any],
-) -> tuple[int, int]:
-    class Payload(BaseModel):
-        # TODO[pydantic]: The following keys were removed: `json_encoders`.
-        # Check https://docs.pydantic.dev/dev-v2/migration/#changes-to-config for more information.
-        model_config = ConfigDict(json_encoders={bytes: lambda bs: bs.hex()})
-
-        sources: list[ContractSource]
-        bytecode: list[ContractBytecode]
-        ir_code: list[YulIRCode | None]
-        init_code: list[ContractInitCode | None]
-        name: str
-        comment: str
-        git_hash: HexString
-        entity_id: int | None = None
-        metadata: dict[str, Any]
-
-    async with aiohttp.ClientSession(
-        headers={"x-api-key": api_key}, json_serialize=lambda x: x.json()
-    ) as session:
+
+from srcup.models import (
+    ContentEncoding, ContractBytecode, ContractInitCode, ContractSource, HexString, PayloadFormat, SourceText, YulIRCode
+)
+from srcup.payload import (
+    SpooledColumn, drop_known, hash_inventory, payload_digest, payload_headers, present, split_payload, stream_payload
+)
+
+
+# Gateway errors and throttling are worth another try, anything else is reported as is
+RETRY_STATUSES = {429, 502, 503, 504}
+# Answers that mean the request was turned down before it was processed, so even uploads can be sent again.
+# A 504, a dropped connection or a timeout can come after the API created the version
+UNPROCESSED_STATUSES = {429, 502, 503}
+
+
+class DedaubClient:
+    """
+        Client for the Dedaub API, holding a single pooled connection for all the calls of a run.
+
+        Idempotent requests (lookups, upload session batches and commits) are retried with exponential backoff
+        on connection errors, timeouts and `RETRY_STATUSES`. Uploads that create a project or a version are only
+        retried when they can't have been processed: on `UNPROCESSED_STATUSES` or a connection that couldn't be
+        established. Their body is rebuilt for every attempt.
+
+        Uploads are sent in `payload_format`. If the API doesn't accept a binary format (HTTP 415), the upload is
+        repeated as JSON, which is then used for the rest of the session.
+
+        With a `batch_size`, uploads go through resumable upload sessions instead of a single request,
+        see `upload_session`.
+    """
+
+    def __init__(
+        self,
+        watchdog_api: str,
+        api_key: str,
+        timeout: float = 300,
+        retries: int = 3,
+        backoff: float = 1.0,
+        connections: int = 8,
+        payload_format: PayloadFormat = PayloadFormat.JSON,
+        batch_size: int = 0,
+        batch_jobs: int = 4,
+        session_dir: Path | None = None,
+    ):
+        self.watchdog_api = watchdog_api
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = connections
+        self.payload_format = payload_format
+        self.batch_size = batch_size
+        self.batch_jobs = batch_jobs
+        self.session_dir = session_dir
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "DedaubClient":
+        self._session = aiohttp.ClientSession(
+            headers={"x-api-key": self.api_key},
+            connector=aiohttp.TCPConnector(limit=self.connections),
+            # No total timeout: large uploads take a while, but a stalled connection shouldn't hang forever
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *_):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise Exception("DedaubClient must be used as an async context manager")
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        idempotent: bool = True,
+        data_factory: Callable[[], Any] | None = None,
+        **kwargs,
+    ) -> aiohttp.ClientResponse:
+        """
+            Returns the response with its body already read. `data_factory` builds the request body for each attempt,
+            streamed bodies can only be consumed once.
+        """
+        url = f"{self.watchdog_api}{path}"
+        attempts = self.retries + 1
+        retry_statuses = RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES
+        retry_errors: tuple[type[Exception], ...] = (
+            (aiohttp.ClientConnectionError, asyncio.TimeoutError) if idempotent else (aiohttp.ClientConnectorError,)
+        )
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            if data_factory is not None:
+                kwargs["data"] = data_factory()
+
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    await response.read()
+                    if response.status not in retry_statuses or last_attempt:
+                        return response
+                    reason = f"HTTP {response.status}"
+            except retry_errors as e:
+                if last_attempt:
+                    raise
+                reason = repr(e)
+
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            print(f"Request to {path} failed ({reason}), retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+    async def post_payload(
+        self,
+        path: str,
+        payload: dict[str, Any],
+        content_encoding: ContentEncoding,
+        method: str = "POST",
+        idempotent: bool = False,
+    ) -> aiohttp.ClientResponse:
+        payload_format = self.payload_format
+        req = await self.request(
+            method,
+            path,
+            idempotent,
+            data_factory=lambda: stream_payload(payload, content_encoding, payload_format),
+            headers=payload_headers(content_encoding, payload_format),
+        )
+
+        if req.status == 415 and payload_format != PayloadFormat.JSON:
+            print(f"WARNING: The API does not accept {payload_format.value} payloads, uploading as JSON...")
+            self.payload_format = PayloadFormat.JSON
+            return await self.post_payload(path, payload, content_encoding, method, idempotent)
+
+        return req
+
+    async def send_payload(
+        self, path: str, payload: dict[str, Any], content_encoding: ContentEncoding
+    ) -> aiohttp.ClientResponse:
+        if self.batch_size:
+            return await self.upload_session(path, payload, content_encoding)
+        return await self.post_payload(path, payload, content_encoding)
+
+    async def upload_session(
+        self, path: str, payload: dict[str, Any], content_encoding: ContentEncoding
+    ) -> aiohttp.ClientResponse:
+        """
+            Uploads `payload` as if it was POSTed to `path`, in batches of about `batch_size` bytes:
+
+            - `POST /upload-session` opens a session with the scalar fields and the number of batches. Like the
+              uploads themselves, it is only retried when it can't have reached the API, not to open a second session
+            - `PUT /upload-session/{id}/batch/{index}` uploads a batch, `batch_jobs` at a time. Batches are
+              idempotent, so they are retried like any other request
+            - `GET /upload-session/{id}` lists the batches the API has received
+            - `POST /upload-session/{id}/commit` creates the version, and answers like `path` would. Committing
+              again answers the same, so it is retried too
+
+            The session id is kept in `session_dir` until the commit, under a digest of the payload, so running the
+            same upload again after a failure only sends the batches that are missing.
+        """
+        fields, batches = split_payload(payload, self.batch_size)
+        digest = payload_digest(f"{self.watchdog_api}{path}", fields, batches)
+        state_path = self.session_dir / f"{digest}.json" if self.session_dir is not None else None
+
+        received: set[int] = set()
+        session_id = self._load_session(state_path)
+        if session_id is not None:
+            req = await self.request("GET", f"/upload-session/{session_id}")
+            if req.status == 200:
+                received = set((await req.json())["received"])
+                print(f"Resuming upload session {session_id} ({len(received)}/{len(batches)} batches already uploaded)")
+            else:
+                session_id = None
+
+        if session_id is None:
+            req = await self.request(
+                "POST",
+                "/upload-session",
+                idempotent=False,
+                json={
+                    "path": path,
+                    "fields": fields,
+                    # Columns left empty, e.g. by `--delta`, are still part of the payload
+                    "columns": sorted(key for key, value in payload.items() if key not in fields and value is not None),
+                    "batches": len(batches),
+                    "digest": digest,
+                },
+            )
+            if req.status in (404, 405):
+                print("WARNING: The API does not support upload sessions, uploading in a single request...")
+                self.batch_size = 0
+                return await self.post_payload(path, payload, content_encoding)
+            if req.status != 200:
+                raise Exception(await req.text())
+            session_id = (await req.json())["session_id"]
+            self._save_session(state_path, session_id)
+
+        print(f"Uploading {len(batches) - len(received)} batches in session {session_id}...")
+        semaphore = asyncio.Semaphore(self.batch_jobs)
+
+        async def send(index: int, batch: dict[str, Any]):
+            async with semaphore:
+                req = await self.post_payload(
+                    f"/upload-session/{session_id}/batch/{index}", batch, content_encoding, "PUT", idempotent=True
+                )
+            if req.status != 200:
+                raise Exception(f"Batch {index}: {await req.text()}")
+            received.add(index)
+
+        # Every batch gets its chance even if some fail, so that less is left for the next attempt
+        errors = [
+            e for e in await asyncio.gather(
+                *(send(index, batch) for index, batch in enumerate(batches) if index not in received),
+                return_exceptions=True,
+            )
+            if isinstance(e, BaseException)
+        ]
+        if errors:
+            raise Exception(
+                f"{len(batches) - len(received)}/{len(batches)} batches failed to upload ({errors[0]}). "
+                "Run the same upload again to resume it"
+            )
+
+        req = await self.request("POST", f"/upload-session/{session_id}/commit")
+        if req.status == 200 and state_path is not None:
+            state_path.unlink(missing_ok=True)
+        return req
+
+    @staticmethod
+    def _load_session(state_path: Path | None) -> str | None:
+        if state_path is None or not state_path.is_file():
+            return None
+        try:
+            with open(state_path) as f:
+                return json.load(f)["session_id"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _save_session(state_path: Path | None, session_id: str):
+        if state_path is None:
+            return
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = state_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"session_id": session_id}, f)
+        os.replace(tmp_path, state_path)
+
+    async def create_project(
+        self,
+        name: str,
+        comment: str,
+        sources: list[ContractSource] | SpooledColumn,
+        bytecode: list[ContractBytecode] | SpooledColumn,
+        ir_code: list[YulIRCode | None] | SpooledColumn,
+        init_code: list[ContractInitCode | None] | SpooledColumn,
+        git_hash: HexString,
+        organization: str,
+        entity_id: int | None,
+        metadata: dict[str, Any],
+        source_table: list[SourceText] | None = None,
+        content_encoding: ContentEncoding = ContentEncoding.IDENTITY,
+    ) -> tuple[int, int]:
         print("Uploading...")
 
-        project_id = await get_project_id(watchdog_api, api_key, name, organization)
+        project_id = await self.get_project_id(name, organization)
 
         if project_id is not None:
             raise Exception(f"Project with name {name} already exists")
 
-        url = f"{watchdog_api}/project"
-        payload=Payload(name=name, sources=sources, bytecode=bytecode, ir_code=[x for x in ir_code if x], init_code=[x for x in init_code if x],
-                        comment=comment, git_hash=git_hash,
-                        entity_id=entity_id,
-                        metadata=metadata)
-
-        req = await session.post(
-            url=url,
-            json=payload
-        )
+        payload = {
+            "sources": sources,
+            "bytecode": bytecode,
+            "ir_code": present(ir_code),
+            "init_code": present(init_code),
+            "name": name,
+            "comment": comment,
+            "git_hash": git_hash,
+            "entity_id": entity_id,
+            "metadata": metadata,
+        }
+        # Only sent in source table mode, the key is unknown to API versions that predate it
+        if source_table is not None:
+            payload["source_table"] = source_table
+
+        req = await self.send_payload("/project", payload, content_encoding)
 
         if req.status == 200:
             print("Done!")
@@ -64,48 +307,43 @@ async def create_project(
             error = await req.text()
             raise Exception(error)
 
-
-async def update_project(
-    watchdog_api: str,
-    api_key: str,
-    owner_username: str,
-    name: str,
-    comment: str,
-    sources: list[ContractSource],
-    bytecode: list[ContractBytecode],
-    ir_code: list[YulIRCode | None],
-    init_code: list[ContractInitCode | None],
-    git_hash: HexString,
-    metadata: dict[str, Any],
-) -> tuple[int, int]:
-    class Payload(BaseModel):
-        # TODO[pydantic]: The following keys were removed: `json_encoders`.
-        # Check https://docs.pydantic.dev/dev-v2/migration/#changes-to-config for more information.
-        model_config = ConfigDict(json_encoders={bytes: lambda bs: bs.hex()})
-        sources: list[ContractSource]
-        bytecode: list[ContractBytecode]
-        ir_code: list[YulIRCode] | None
-        init_code: list[ContractInitCode | None]
-        comment: str
-        git_hash: HexString
-        metadata: dict[str, Any]
-
-    async with aiohttp.ClientSession(
-        headers={"x-api-key": api_key}, json_serialize=lambda x: x.json()
-    ) as session:
+    async def update_project(
+        self,
+        owner_username: str,
+        name: str,
+        comment: str,
+        sources: list[ContractSource] | SpooledColumn,
+        bytecode: list[ContractBytecode] | SpooledColumn,
+        ir_code: list[YulIRCode | None] | SpooledColumn,
+        init_code: list[ContractInitCode | None] | SpooledColumn,
+        git_hash: HexString,
+        metadata: dict[str, Any],
+        source_table: list[SourceText] | None = None,
+        content_encoding: ContentEncoding = ContentEncoding.IDENTITY,
+        delta: bool = False,
+    ) -> tuple[int, int]:
         print("Uploading...")
 
-        project_id = await get_project_id(watchdog_api, api_key, name, owner_username)
+        project_id = await self.get_project_id(name, owner_username)
         if project_id is None:
             raise Exception(f"No project with name {name} exists")
 
-        url = f"{watchdog_api}/project/{project_id}/version"
-        payload=Payload(sources=sources, bytecode=bytecode, ir_code=[x for x in ir_code if x], init_code=[x for x in init_code if x], comment=comment, git_hash=git_hash, metadata=metadata)
+        payload = {
+            "sources": sources,
+            "bytecode": bytecode,
+            "ir_code": present(ir_code),
+            "init_code": present(init_code),
+            "comment": comment,
+            "git_hash": git_hash,
+            "metadata": metadata,
+        }
+        if source_table is not None:
+            payload["source_table"] = source_table
 
-        req = await session.post(
-            url=url,
-            json=payload,
-        )
+        if delta and (known := await self.get_known_hashes(project_id, hash_inventory(payload))) is not None:
+            payload = drop_known(payload, known)
+
+        req = await self.send_payload(f"/project/{project_id}/version", payload, content_encoding)
 
         if req.status == 200:
             version_id = await req.json()
@@ -115,28 +353,42 @@ async def update_project(
             error = await req.text()
             raise Exception(error)
 
+    async def get_known_hashes(
+        self,
+        project_id: int,
+        inventory: dict[str, list[str]],
+    ) -> dict[str, list[str]] | None:
+        req = await self.request("POST", f"/project/{project_id}/known-hashes", json=inventory)
 
-async def get_project_id(watchdog_api: str,
-                         api_key: str,
-                         name: str,
-                         owner_username: str = '',
-                         ) -> int | None:
-
-    async with aiohttp.ClientSession(
-            headers={"x-api-key": api_key}) as session:
-
-        url = f"{watchdog_api}/project/exists/{name}"
+        if req.status == 200:
+            return await req.json()
+        else:
+            print("WARNING: The API does not support delta uploads, uploading everything...")
+            return None
 
+    async def get_project_id(self, name: str, owner_username: str = '') -> int | None:
         if owner_username:
-            req = await session.get(url=url,  params={'owner_username': owner_username})
+            req = await self.request("GET", f"/project/exists/{name}", params={'owner_username': owner_username})
         else:
-            req = await session.get(url=url)
+            req = await self.request("GET", f"/project/exists/{name}")
 
         if req.status == 200:
             return await req.json()
         else:
             return None  # project does not exist
 
+    async def get_org_entity_id(self, org_name: str) -> int:
+        req = await self.request("GET", f"/entity/{org_name}")
+
+        if req.status == 200:
+            ret = await req.json()
+            if ret['entity_id'] is None:
+                raise Exception(f"There is no organisation with the name {org_name}")
+            return int(ret['entity_id'])
+        else:
+            error = await req.text()
+            raise Exception(error)
+
 
 def extract_organization_from_name(name) -> tuple[str, str]:
     if name and '/' in name:
@@ -150,21 +402,3 @@ def extract_organization_from_name(name) -> tuple[str, str]:
         return org_name, project_name
 
     return '',  name
-
-
-async def get_org_entity_id(watchdog_api: str, api_key: str, org_name: str) -> int:
-
-    async with (aiohttp.ClientSession(headers={"x-api-key": api_key}) as session):
-        url = f"{watchdog_api}/entity/{org_name}"
-
-        req = await session.get(url=url)
-
-        if req.status == 200:
-            ret = await req.json()
-            if ret['entity_id'] is None:
-                raise Exception(f"There is no organisation with the name {org_name}")
-            return int(ret['entity_id'])
-        else:
-            error = await req.text()
-            raise Exception(error)
-
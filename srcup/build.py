@@ -1,15 +1,27 @@
 import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Iterator
 
 from crytic_compile.crytic_compile import CryticCompile, compile_all
+from crytic_compile.platform.exceptions import InvalidCompilation
 from crytic_compile.platform.types import Type
 from crytic_compile.platform.solc import Solc, relative_to_short
 from crytic_compile.utils.naming import convert_filename, extract_name
 from crytic_compile.utils.zip import save_to_zip
 from srcup.models import BuildSystem
 from srcup.config_handlers import handle_hardhat_config, handle_foundry_config
+from srcup.fingerprint import build_sources, is_unchanged, record, source_fingerprint, tracked_files
+from srcup.profiling import phase
+from srcup.utils import __version__, can_fork
+
+try:
+    import ijson  # type: ignore[import]
+except ImportError:
+    ijson = None  # type: ignore[assignment]
 
 
 class ExtraFieldsOfSourceUnit:
@@ -33,7 +45,9 @@ class ExtraFieldsOfSourceUnit:
         self.contract_to_debug_info[contract_name] = debug_info
 
 """
-    Compiles a single build and exports it to the `export_dir` directory. Output can be compressed.
+    Compiles a single build and, if an `export_format` is given, exports it to the `export_dir` directory
+    (see `export_build`). Output can be compressed. With `auto_cache`, the build artifacts are reused if the sources, config files and settings are the same
+    as in the last successful build of `build_path` recorded in `export_dir`.
 
     Raises:
     [compilation]
@@ -52,95 +66,278 @@ def compile_build(
     use_cached_build: bool = False,
     compression_type: str | None = None,  # suppored: lzma, stored, deflated, bzip2
     export_dir: str = "watchdog",
-    export_format: str = "archive",  # include source content in the exported json
-) -> tuple[CryticCompile, dict[str, ExtraFieldsOfSourceUnit], str, str | None]:
+    export_format: str | None = None,  # "archive" includes source content in the exported json
+    jobs: int = 1,
+    auto_cache: bool = False,
+) -> tuple[CryticCompile, dict[str, ExtraFieldsOfSourceUnit], str | None, str | None]:
     class CustomCryticCompile(CryticCompile):
+        # Where the parsed artifacts live when they are not in the build system's default directory
+        artifacts_directory: str | None = None
+
         def _compile(self, **kwargs: str) -> None:
             if not (use_ir or extract_debug):
-                return super()._compile(**kwargs)
+                with phase("build tool"):
+                    return super()._compile(**kwargs)
 
-            config_handlers: dict[Type, Callable[[str, bool], tuple[Path, str] | None]] = {
+            config_handlers: dict[Type, Callable[[str, bool, bool], ContextManager[dict[str, Any]]]] = {
                 Type.HARDHAT: handle_hardhat_config,
                 Type.FOUNDRY: handle_foundry_config,
             }
 
-            handler = config_handlers.get(self.platform.TYPE, lambda *_: None)
-
-            original_config = handler(build_path, use_ir)
+            handler = config_handlers.get(self.platform.TYPE, lambda *_: nullcontext({}))
 
             if self.platform.TYPE == Solc and use_ir:
                 kwargs["compile_custom_build"] = "solc -o ./ --ir-optimized " + build_path
 
-            try:
+            if not kwargs.get("ignore_compile"):
                 print("Building project...")
+            # Hardhat and Foundry builds run inside the handler, see `config_handlers`
+            with phase("build tool"), handler(build_path, use_ir, bool(kwargs.get("ignore_compile"))) as overrides:
+                kwargs.update(overrides)
+                self.artifacts_directory = kwargs.get("hardhat_artifacts_directory") or kwargs.get("foundry_out_directory")
                 return super()._compile(**kwargs)
-            finally:
-                if not original_config:
-                    return
 
-                path, content = original_config
-                with open(path, "w") as f:
-                    f.write(content)
+    fingerprint: str | None = None
+    sources: list[str] = []
+    reuse_build = False
+    if auto_cache and not use_cached_build:
+        settings = {"use_ir": use_ir, "debug": extract_debug, "framework": framework, "srcup": __version__}
+        sources = build_sources(export_dir, os.path.abspath(build_path))
+        with phase("fingerprint"):
+            fingerprint = source_fingerprint(build_path, settings, sources)
+        reuse_build = is_unchanged(export_dir, os.path.abspath(build_path), fingerprint)
+        if reuse_build:
+            print("Sources unchanged since the last build, reusing its artifacts")
 
     extra_fields: dict[str, ExtraFieldsOfSourceUnit] = {}
-    kwargs: dict[str, Any] = {"ignore_compile": use_cached_build, "foundry_compile_all": True}
+    kwargs: dict[str, Any] = {"ignore_compile": use_cached_build or reuse_build, "foundry_compile_all": True}
     if framework:
         kwargs["compile_force_framework"] = framework.value
 
-    build = CustomCryticCompile(build_path, **kwargs)
+    try:
+        build = CustomCryticCompile(build_path, **kwargs)
+    except (InvalidCompilation, OSError):
+        if not reuse_build:
+            raise
+        print("Could not reuse the previous build, compiling...")
+        kwargs["ignore_compile"] = False
+        build = CustomCryticCompile(build_path, **kwargs)
 
     if build.platform.TYPE == Type.HARDHAT:
         build_directory = Path(
             build.target,
-            "artifacts",
+            build.artifacts_directory or "artifacts",
             "build-info",
         )
-        extra_fields = get_extra_fields(build, build.target, build_directory, build.target, use_ir)
+        with phase("extra fields"):
+            extra_fields = get_extra_fields(build, build.target, build_directory, build.target, use_ir, jobs)
+    elif build.platform.TYPE == Type.FOUNDRY and (use_ir or extract_debug):
+        with phase("extra fields"):
+            extra_fields = get_foundry_extra_fields(
+                build, build.target, Path(build.target, build.artifacts_directory or "out"), use_ir, jobs
+            )
+
+    export_path: str | None = None
+    zip_path: str | None = None
+    if export_format:
+        with phase("export"):
+            export_path, zip_path = export_build(build, export_dir, export_format, compression_type)
+
+    if fingerprint is not None:
+        # A build that used sources the fingerprint didn't cover is recorded without one: the next run builds again
+        built_sources = sorted({filename.absolute for filename in build.filenames})
+        covered = set(built_sources) <= set(tracked_files(build_path, sources))
+        record(export_dir, os.path.abspath(build_path), fingerprint if covered else None, built_sources)
+
+    return build, extra_fields, export_path, zip_path
+
 
+def export_build(
+    build: CryticCompile,
+    export_dir: str = "watchdog",
+    export_format: str = "archive",
+    compression_type: str | None = None,  # suppored: lzma, stored, deflated, bzip2
+) -> tuple[str, str | None]:
+    """
+        Exports a compiled build to `export_dir` and optionally zips it into `out.zip`. Nothing srcup uploads
+        depends on the export, so it can run in the background while the contracts are extracted and uploaded.
+    """
     # crytic-compile automatically creates the `export_dir` directory if it does not exist
-    export_path: str = build.export(export_format=export_format, export_dir=export_dir)[
-        0
-    ]
+    export_path: str = build.export(export_format=export_format, export_dir=export_dir)[0]
 
     zip_path: str | None = None
     if compression_type:
         zip_path = os.path.join(export_dir, "out.zip")
         save_to_zip([build], zip_path, compression_type)
-        return build, extra_fields, export_path, zip_path
 
-    return build, extra_fields, export_path, zip_path
+    return export_path, zip_path
+
+
+def iter_build_info_contracts(build_info: Path) -> Iterator[tuple[str, dict]]:
+    """
+        Yields the `output.contracts` entries of a solc standard-JSON build-info, one source file at a time.
+        With ijson installed the file is streamed: the input sources and the ASTs are skipped by the parser
+        instead of being loaded, which otherwise takes several times the size of the file in memory.
+    """
+    with open(build_info, "rb") as file_desc:
+        if ijson is None:
+            yield from json.load(file_desc)["output"].get("contracts", {}).items()
+        else:
+            yield from ijson.kvitems(file_desc, "output.contracts", use_float=True)
+
+
+def index_build_infos(build_directory: Path) -> dict[str, set[str]] | None:
+    """
+        Maps each build-info file to the source files it is authoritative for, according to the `.dbg.json` files
+        Hardhat writes next to every artifact. Build-infos that no artifact points to anymore are superseded.
+        Returns None if there are no debug files to go by.
+    """
+    artifacts_directory = build_directory.parent
+    index: dict[str, set[str]] = {}
+
+    for root, dirs, files in os.walk(artifacts_directory):
+        if Path(root) == artifacts_directory and build_directory.name in dirs:
+            dirs.remove(build_directory.name)
+
+        for file in files:
+            if not file.endswith(".dbg.json"):
+                continue
+            try:
+                with open(Path(root, file), encoding="utf8") as file_desc:
+                    build_info = json.load(file_desc)["buildInfo"]
+            except (OSError, ValueError, KeyError):
+                continue
+            # The artifact directories mirror the source names, e.g. artifacts/contracts/Token.sol/Token.dbg.json
+            source_name = Path(root).relative_to(artifacts_directory).as_posix()
+            index.setdefault(Path(build_info).name, set()).add(source_name)
+
+    return index or None
+
+
+def load_build_info(
+    build_info: Path, use_ir: bool, source_names: set[str] | None
+) -> list[tuple[str, list[tuple[str, Any, Any, Any]]]]:
+    # Runs in the worker processes, so only returns plain data: (source, [(contract, ir, immutable refs, debug info)])
+    loaded = []
+    for original_filename, contracts_info in iter_build_info_contracts(build_info):
+        if source_names is not None and original_filename not in source_names:
+            continue
+        loaded.append((original_filename, [
+            (
+                extract_name(original_contract_name),
+                info.get("irOptimized") if use_ir else None,
+                info["evm"]["deployedBytecode"].get("immutableReferences"),
+                info["evm"]["deployedBytecode"].get("functionDebugData"),
+            )
+            for original_contract_name, info in contracts_info.items()
+        ]))
+    return loaded
 
 
 def get_extra_fields(
-    crytic_compile: "CryticCompile", target: str, build_directory: Path, working_dir: str, use_ir: bool
+    crytic_compile: "CryticCompile", target: str, build_directory: Path, working_dir: str, use_ir: bool, jobs: int = 1
 ) -> dict:
     src_to_extra_fields: dict[str, ExtraFieldsOfSourceUnit] = {}
     files = sorted(
         os.listdir(build_directory), key=lambda x: os.path.getmtime(Path(build_directory, x))
     )
     files = [str(f) for f in files if str(f).endswith(".json")]
-    for file in files:
-        build_info = Path(build_directory, file)
-        with open(build_info, encoding="utf8") as file_desc:
-            loaded_json = json.load(file_desc)
-            targets_json = loaded_json["output"]
-            if "contracts" in targets_json:
-                for original_filename, contracts_info in targets_json["contracts"].items():
-
-                    filename = convert_filename(
-                        original_filename,
-                        relative_to_short,
-                        crytic_compile,
-                        working_dir=working_dir,
-                    )
-                    src_to_extra_fields[filename.absolute] = ExtraFieldsOfSourceUnit(filename.absolute)
-                    for original_contract_name, info in contracts_info.items():
-                        contract_name = extract_name(original_contract_name)
-                        src_to_extra_fields[filename.absolute].add_contract(contract_name)
-                        if use_ir:
-                            src_to_extra_fields[filename.absolute].add_ir(contract_name, info.get("irOptimized"))
-                        src_to_extra_fields[filename.absolute].add_immutable_ref(contract_name, info["evm"]["deployedBytecode"].get("immutableReferences"))
-                        src_to_extra_fields[filename.absolute].add_debug_info(contract_name, info["evm"]["deployedBytecode"].get("functionDebugData"))
+
+    index = index_build_infos(build_directory)
+    if index is not None:
+        skipped = [f for f in files if f not in index]
+        if skipped:
+            print(f"Skipping {len(skipped)} superseded build-info files")
+        files = [f for f in files if f in index]
+
+    args = [(Path(build_directory, f), use_ir, index[f] if index is not None else None) for f in files]
+    if jobs > 1 and len(args) > 1:
+        # The arguments pickle cheaply, so the workers can start from a fresh interpreter when forking is unsafe
+        start_method = "fork" if can_fork() else "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(min(jobs, len(args)), mp_context=multiprocessing.get_context(start_method)) as executor:
+            loaded = list(executor.map(load_build_info, *zip(*args)))
+    else:
+        loaded = [load_build_info(*a) for a in args]
+
+    # Oldest first, so that newer build-infos take precedence
+    for build_info_contracts in loaded:
+        for original_filename, contracts in build_info_contracts:
+
+            filename = convert_filename(
+                original_filename,
+                relative_to_short,
+                crytic_compile,
+                working_dir=working_dir,
+            )
+            src_to_extra_fields[filename.absolute] = ExtraFieldsOfSourceUnit(filename.absolute)
+            for contract_name, ir, im_ref, debug_info in contracts:
+                src_to_extra_fields[filename.absolute].add_contract(contract_name)
+                if use_ir:
+                    src_to_extra_fields[filename.absolute].add_ir(contract_name, ir)
+                src_to_extra_fields[filename.absolute].add_immutable_ref(contract_name, im_ref)
+                src_to_extra_fields[filename.absolute].add_debug_info(contract_name, debug_info)
+    return src_to_extra_fields
+
+
+def index_foundry_ir(out_directory: Path) -> dict[tuple[str, str], Path]:
+    """
+        Maps (source file name, contract name) to the `<File.sol>/<Contract>.iropt` files Foundry writes
+        with `--extra-output-files irOptimized`, listing each directory of `out/` once.
+    """
+    index: dict[tuple[str, str], Path] = {}
+    try:
+        directories = [entry for entry in os.scandir(out_directory) if entry.is_dir() and entry.name != "build-info"]
+    except OSError:
+        return index
+
+    for directory in directories:
+        for entry in os.scandir(directory.path):
+            if entry.name.endswith(".iropt"):
+                index[(directory.name, entry.name[:-len(".iropt")])] = Path(entry.path)
+    return index
+
+
+def _read_text(path: Path) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def get_foundry_extra_fields(
+    crytic_compile: "CryticCompile", target: str, out_directory: Path, use_ir: bool, jobs: int = 1
+) -> dict[str, ExtraFieldsOfSourceUnit]:
+    """
+        Foundry counterpart of `get_extra_fields`, keyed by absolute source path as well: immutable references,
+        debug data and IR come from Foundry's build-info files, which are laid out like Hardhat's. IR that the
+        build-info doesn't have is read from the `.iropt` files found by `index_foundry_ir`, a few at a time.
+        Foundry IR is kept as the raw Yul text.
+    """
+    build_directory = out_directory / "build-info"
+    src_to_extra_fields: dict[str, ExtraFieldsOfSourceUnit] = (
+        get_extra_fields(crytic_compile, target, build_directory, target, use_ir, jobs) if build_directory.is_dir() else {}
+    )
+    if not use_ir:
+        return src_to_extra_fields
+
+    ir_files = index_foundry_ir(out_directory)
+    missing: list[tuple[str, str, Path]] = []
+    for compilation_unit in crytic_compile.compilation_units.values():
+        for source_unit in compilation_unit.source_units.values():
+            extra_fields_of_file = src_to_extra_fields.get(source_unit.filename.absolute)
+            filename_only = source_unit.filename.short.split("/")[-1]
+            for contract_name in source_unit.contracts_names:
+                if extra_fields_of_file is not None and extra_fields_of_file.contract_to_ir.get(contract_name):
+                    continue
+                if (ir_file := ir_files.get((filename_only, contract_name))) is not None:
+                    missing.append((source_unit.filename.absolute, contract_name, ir_file))
+
+    # Reads are mostly waiting on the filesystem, which threads overlap even on a single core
+    with ThreadPoolExecutor(min(32, 4 * jobs)) as executor:
+        contents = executor.map(_read_text, [ir_file for _, _, ir_file in missing])
+        for (filename, contract_name, _), ir_code in zip(missing, contents):
+            if filename not in src_to_extra_fields:
+                src_to_extra_fields[filename] = ExtraFieldsOfSourceUnit(filename)
+            src_to_extra_fields[filename].add_ir(contract_name, ir_code)
+
     return src_to_extra_fields
 
 
@@ -0,0 +1,81 @@
+import copy
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any
+
+
+class ExtractionCache:
+    """
+        On-disk cache of extracted contract records, keyed by a fingerprint of the build outputs they were extracted from.
+        Entries are pickled into one file each; the least recently used ones are evicted once `max_size` bytes is exceeded.
+    """
+
+    def __init__(self, directory: Path, max_size: int, namespace: str = ""):
+        self.directory = Path(directory, namespace) if namespace else Path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def scoped(self) -> "ExtractionCache":
+        """
+            The same cache, with hit and miss counts of its own: `srcup multi` shares one cache between projects.
+        """
+        view = copy.copy(self)
+        view.hits = view.misses = 0
+        return view
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.pkl"
+
+    def has(self, key: str) -> bool:
+        # Counted as a miss right away, a hit is only counted once the entry is actually read by `get`
+        if self._path(key).is_file():
+            return True
+        self.misses += 1
+        return False
+
+    def get(self, key: str) -> Any | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Corrupt or written by an incompatible version
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+
+        # Bump the entry for LRU eviction
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
@@ -1,51 +1,143 @@
 #!/usr/bin/env python3
 
-import asyncio
+# crytic-compile, pydantic, aiohttp and eth-hash are only imported by the code paths that use them,
+# to keep `--help`, `--version` and shell completion fast (see benchmarks/startup.py)
+from __future__ import annotations
+
+import json
 import os
 import pathlib
 import sys
 import typer
-from crytic_compile import InvalidCompilation
 
-from crytic_compile.crytic_compile import CryticCompile
 from hashlib import sha1
+from contextlib import AbstractContextManager, nullcontext
 from subprocess import Popen, PIPE, TimeoutExpired
-from typing import Optional, cast
+from threading import Thread
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from srcup.cache import ExtractionCache
+from srcup.constants import ArchiveCompression, BuildSystem, ContentEncoding, PayloadFormat
+from srcup.utils import CONFIG_PATH, start_helper_thread, version_callback, __version__
+
+if TYPE_CHECKING:
+    from crytic_compile.crytic_compile import CryticCompile
+
+    from srcup.api import DedaubClient
+    from srcup.build import ExtraFieldsOfSourceUnit
+    from srcup.extract import ContractRecord
+    from srcup.payload import PayloadSpool
+
+
+# Options shared by `single`, `multi` and `watch`
+FRAMEWORK = typer.Option(None)
+CACHE = typer.Option(False, help="Use build cache")
+AUTO_CACHE = typer.Option(True, help="Reuse the previous build if no source, config file or setting changed since")
+INIT = typer.Option(False, help="Create a new project instead of uploading a new version of an existing one")
+ORGANIZATION = typer.Option(default='', help="Organization to which the project belongs. Ignored when --init is not present")
+API_URL = typer.Option("https://api.dedaub.com/api", help="URL of the Dedaub API")
+API_KEY = typer.Option(..., envvar="WD_API_KEY", help="Dedaub API key")
+OWNER_USERNAME = typer.Option('', help="Username of project owner. Ignored when --init is also present")
+NAME = typer.Option('', help="Project name")
+COMMENT = typer.Option('', help="Comment for the uploaded version")
+USE_IR = typer.Option(False, help="Analyse Yul-IR instead of EVM bytecode")
+DEBUG_INFO = typer.Option(True, help="Extract debug info from the build artifacts. This can help recover some high-level names.")
+INIT_CODE = typer.Option(False, help="Extract the init code from the build artifacts.")
+DEDUP_SOURCES = typer.Option(False, help="Upload each distinct source file once and have contracts reference it.")
+CONTENT_ENCODING = typer.Option(ContentEncoding.IDENTITY, help="Compression applied to the upload body.")
+PAYLOAD_FORMAT = typer.Option(PayloadFormat.JSON, help="Serialization of the upload body. msgpack sends bytecode and hashes as raw bytes")
+DELTA = typer.Option(False, help="Only upload the code and sources the API doesn't already have. Implies --dedup-sources. Ignored when --init is present")
+EXTRACT_CACHE = typer.Option(True, help=f"Reuse contracts extracted by previous runs, cached in {CONFIG_PATH / 'cache'}")
+EXTRACT_CACHE_SIZE = typer.Option(512, help="Maximum size of the extraction cache in MB")
+JOBS = typer.Option(1, "--jobs", "-j", help="Number of parallel workers for loading build-info files and extracting contracts (0 uses all CPUs)")
+TIMEOUT = typer.Option(300, help="Seconds to wait on a stalled connection to the Dedaub API")
+RETRIES = typer.Option(3, help="How many times to retry API calls that failed with a transient error")
+BATCH_SIZE = typer.Option(0, help="Upload in a resumable session, in batches of about this many MB. 0 uploads everything in a single request")
+BATCH_JOBS = typer.Option(4, help="How many batches of an upload session to send at the same time")
+
+
+def make_client(
+    api_url: str,
+    api_key: str,
+    timeout: float,
+    retries: int,
+    payload_format: PayloadFormat,
+    batch_size: int,
+    batch_jobs: int,
+    connections: int = 8,
+) -> DedaubClient:
+    from srcup.api import DedaubClient
+
+    return DedaubClient(
+        api_url, api_key, timeout=timeout, retries=retries, connections=connections, payload_format=payload_format,
+        batch_size=batch_size * 1024 * 1024, batch_jobs=batch_jobs, session_dir=CONFIG_PATH / "upload-sessions",
+    )
+
 
-from srcup.api import create_project, update_project, get_org_entity_id, extract_organization_from_name
-from srcup.build import ExtraFieldsOfSourceUnit, compile_build
-from srcup.extract import process
-from srcup.models import BuildSystem, ContractBytecode, ContractInitCode, ContractSource, YulIRCode
-from srcup.utils import version_callback, __version__
+def make_extraction_cache(size: int) -> ExtractionCache:
+    return ExtractionCache(CONFIG_PATH / "cache" / "extract", size * 1024 * 1024, __version__)
 
 
 app = typer.Typer()
 
 
-@app.command()
+@app.command(epilog="Several projects can be uploaded at once with `srcup multi`, and `srcup watch` uploads a new version "
+                    "whenever a project changes. See `srcup multi --help` and `srcup watch --help`.")
 def single(
     target: str = typer.Argument(...),
-    framework: Optional[BuildSystem] = typer.Option(None),
-    cache: bool = typer.Option(False, help="Use build cache"),
-    init: bool = typer.Option(False, help="Is this a new project?"),
-    organization: str = typer.Option(default='', help="Organization to which the project belongs. Ignored when --init is not present"),
-    api_url: str = typer.Option(
-          "https://api.dedaub.com/api",
-        help="URL of the Dedaub API"
-    ),
-    api_key: str = typer.Option(..., envvar="WD_API_KEY", help="Dedaub API key"),
-    owner_username: str = typer.Option('', help="Username of project owner. Ignored when --init is also present"),
-    name: str = typer.Option('', help="Project name"),
-    comment: str = typer.Option('', help="Comment for the project"),
+    framework: Optional[BuildSystem] = FRAMEWORK,
+    cache: bool = CACHE,
+    auto_cache: bool = AUTO_CACHE,
+    init: bool = INIT,
+    organization: str = ORGANIZATION,
+    api_url: str = API_URL,
+    api_key: str = API_KEY,
+    owner_username: str = OWNER_USERNAME,
+    name: str = NAME,
+    comment: str = COMMENT,
     app_version: bool = typer.Option(False, '--version', '-v', help="Show the version of the app", is_eager=True, callback=version_callback),
-    use_ir: bool = typer.Option(False, help="Analyse Yul-IR instead of EVM bytecode"),
-    debug_info: bool = typer.Option(True, help="Extract debug info from the build artifacts. This can help recover some high-level names."),
-    init_code: bool = typer.Option(False, help="Extract the init code from the build artifacts."),
+    use_ir: bool = USE_IR,
+    debug_info: bool = DEBUG_INFO,
+    init_code: bool = INIT_CODE,
+    dedup_sources: bool = DEDUP_SOURCES,
+    content_encoding: ContentEncoding = CONTENT_ENCODING,
+    payload_format: PayloadFormat = PAYLOAD_FORMAT,
+    delta: bool = DELTA,
+    extract_cache: bool = EXTRACT_CACHE,
+    extract_cache_size: int = EXTRACT_CACHE_SIZE,
+    jobs: int = JOBS,
+    export_selectors: Optional[pathlib.Path] = typer.Option(None, help="Write the signature -> selector table of all the contracts to this JSON file"),
+    export_archive: bool = typer.Option(False, help="Also export the build as an archive into watchdog/, zipped with --archive-compression. Not needed for the upload"),
+    archive_compression: ArchiveCompression = typer.Option(ArchiveCompression.LZMA, help="Compression of the exported archive"),
+    timeout: float = TIMEOUT,
+    retries: int = RETRIES,
+    batch_size: int = BATCH_SIZE,
+    batch_jobs: int = BATCH_JOBS,
+    profile: bool = typer.Option(False, help="Print the time, CPU, memory and bytes spent in each phase of the run. Tracing memory slows the run down"),
+    profile_json: Optional[pathlib.Path] = typer.Option(None, help="Also write the --profile report to this JSON file"),
+    profile_extraction: Optional[pathlib.Path] = typer.Option(None, help="Write a cProfile dump of the extraction phase to this file. Use with -j 1 to include the extraction itself"),
 ):
+    import asyncio
+    from crytic_compile import InvalidCompilation
+
+    from srcup import profiling
+    from srcup.build import compile_build
+
+    profiler = profiling.start() if profile or profile_json or profile_extraction else None
     try:
         target = os.path.abspath(target)
-        build, extra_fields, *_ = compile_build(target, use_ir, debug_info, framework, cache, "lzma")
-        asyncio.run(asingle(build, extra_fields, use_ir, debug_info, init_code, api_url, api_key, init, organization, owner_username, name, comment, target))
+        jobs = jobs or os.cpu_count() or 1
+        with profiling.phase("compile"):
+            build, extra_fields, *_ = compile_build(target, use_ir, debug_info, framework, cache, jobs=jobs, auto_cache=auto_cache)
+        export = start_export(build, "watchdog", archive_compression) if export_archive else None
+        extraction_cache = make_extraction_cache(extract_cache_size) if extract_cache else None
+        client = make_client(api_url, api_key, timeout, retries, payload_format, batch_size, batch_jobs)
+        try:
+            asyncio.run(asingle(build, extra_fields, use_ir, debug_info, init_code, client, init, organization, owner_username, name, comment, target, dedup_sources, content_encoding, delta, extraction_cache, jobs, export_selectors, profile_extraction))
+        finally:
+            if export is not None:
+                with profiling.phase("export"):
+                    export.join()
     except InvalidCompilation as e:
         print(f"Unable to perform compilation.\n")
         print("""
@@ -54,6 +146,27 @@ def single(
             """)
         print(f"Error message was: {str(e)}")
         sys.exit(-1)
+    finally:
+        if profiler is not None:
+            print(f"\n{profiler.report()}")
+            if profile_json is not None:
+                profiler.write_json(profile_json)
+
+
+def start_export(build: CryticCompile, export_dir: str, compression: ArchiveCompression) -> Thread:
+    """
+        Exports and zips the build in a background thread, while the contracts are extracted and uploaded.
+    """
+    from srcup.build import export_build
+
+    def run():
+        try:
+            _, zip_path = export_build(build, export_dir, "archive", compression.value)
+            print(f"Exported the build to {zip_path}")
+        except Exception as e:
+            print(f"WARNING: Exporting the build failed: {e}")
+
+    return start_helper_thread(run, "srcup-export")
 
 
 async def asingle(
@@ -62,31 +175,112 @@ async def asingle(
     use_ir: bool,
     get_debug_info: bool,
     get_init_code: bool,
-    api_url: str,
-    api_key: str,
+    client: DedaubClient,
     init: bool,
     organization: str,
     owner_username: str,
     name: str,
     comment: str,
-    target: str
+    target: str,
+    dedup_sources: bool = False,
+    content_encoding: ContentEncoding = ContentEncoding.IDENTITY,
+    delta: bool = False,
+    extraction_cache: ExtractionCache | None = None,
+    jobs: int = 1,
+    export_selectors: pathlib.Path | None = None,
+    profile_extraction: pathlib.Path | None = None,
 ):
-    contracts = process(artifact, extra_fields, use_ir, get_debug_info, get_init_code)
+    import cProfile
 
-    sources: list[ContractSource] = []
-    bytecodes: list[ContractBytecode] = []
-    yul_ir: list[YulIRCode | None] = []
-    init_code: list[ContractInitCode | None] = []
+    from srcup.payload import PayloadSpool, spool_records
+    from srcup.profiling import phase
 
-    if len(contracts):
-        sources, bytecodes, yul_ir, init_code = cast(
-            tuple[list[ContractSource], list[ContractBytecode], list[YulIRCode | None], list[ContractInitCode | None]], tuple(zip(*contracts))
-        )
-    else:
-        print("WARNING: Discovered 0 contracts -- are you pointing srcup to the right directory? Aborting upload...")
-        return
+    # Records are serialized into the spool as they are extracted, instead of being kept as models
+    with PayloadSpool(client.payload_format) as spool:
+        records = iter_contracts(artifact, extra_fields, use_ir, get_debug_info, get_init_code, extraction_cache, jobs, export_selectors)
+        profile_context: AbstractContextManager[cProfile.Profile | None] = nullcontext()
+        if profile_extraction is not None:
+            profile_context = cProfile.Profile()
+        with phase("extraction"), profile_context as profiler:
+            columns, codehashes = spool_records(records, spool, dedup_sources or (delta and not init))
+        if profiler is not None and profile_extraction is not None:
+            profiler.dump_stats(profile_extraction)
 
-    git_hash = await calc_hash(bytecodes, target)
+        if not codehashes:
+            print("WARNING: Discovered 0 contracts -- are you pointing srcup to the right directory? Aborting upload...")
+            return
+
+        try:
+            async with client:
+                project_id, version_sequence = await upload(
+                    client, artifact, columns, codehashes, target, use_ir, get_debug_info, init, organization, owner_username,
+                    name, comment, content_encoding, delta
+                )
+            print(f"{project_id} {version_sequence}")
+
+        except Exception as e:
+            print(f"Something went wrong with the project: {e}")
+            sys.exit(-1)
+
+
+def iter_contracts(
+    artifact: CryticCompile,
+    extra_fields: dict[str, ExtraFieldsOfSourceUnit],
+    use_ir: bool,
+    get_debug_info: bool,
+    get_init_code: bool,
+    extraction_cache: ExtractionCache | None = None,
+    jobs: int = 1,
+    export_selectors: pathlib.Path | None = None,
+) -> Iterator[ContractRecord]:
+    from srcup.extract import SELECTOR_TYPES, iter_process, selector_table
+
+    if extraction_cache is not None:
+        extraction_cache = extraction_cache.scoped()
+
+    selectors: dict[str, dict[str, str]] = {kind: {} for kind in SELECTOR_TYPES}
+    for record in iter_process(artifact, extra_fields, use_ir, get_debug_info, get_init_code, extraction_cache, jobs):
+        if export_selectors is not None:
+            for kind, table in selector_table([record]).items():
+                selectors[kind].update(table)
+        yield record
+
+    if extraction_cache is not None and extraction_cache.hits:
+        print(f"Reused {extraction_cache.hits} cached source units ({extraction_cache.misses} extracted)")
+
+    if export_selectors is not None:
+        with open(export_selectors, "w") as f:
+            json.dump({kind: dict(sorted(table.items())) for kind, table in selectors.items()}, f, indent=2)
+
+
+async def upload(
+    client: DedaubClient,
+    artifact: CryticCompile,
+    columns: dict[str, Any],
+    codehashes: list[bytes],
+    target: str,
+    use_ir: bool,
+    get_debug_info: bool,
+    init: bool,
+    organization: str,
+    owner_username: str,
+    name: str,
+    comment: str,
+    content_encoding: ContentEncoding = ContentEncoding.IDENTITY,
+    delta: bool = False,
+) -> tuple[int, int]:
+    """
+        Uploads the payload `columns` built by `payload.spool_records`.
+    """
+    from srcup.api import extract_organization_from_name
+    from srcup.profiling import phase
+
+    sources, bytecodes, yul_ir, init_code, source_table = (
+        columns["sources"], columns["bytecode"], columns["ir_code"], columns["init_code"], columns["source_table"]
+    )
+
+    with phase("git hash"):
+        git_hash = await calc_hash(codehashes, target)
 
     if not name:
         name = pathlib.Path(target).resolve().name
@@ -94,15 +288,13 @@ async def asingle(
     if not organization:
         organization, name = extract_organization_from_name(name)
 
-    try:
-        if init:
-            entity_id: int | None = None
-            if organization:
-                entity_id = await get_org_entity_id(api_url, api_key, organization)
-
-            project_id, version_sequence = await create_project(
-                api_url,
-                api_key,
+    if init:
+        entity_id: int | None = None
+        if organization:
+            entity_id = await client.get_org_entity_id(organization)
+
+        with phase("upload"):
+            project_id, version_sequence = await client.create_project(
                 name,
                 comment,
                 sources,
@@ -112,24 +304,23 @@ async def asingle(
                 git_hash,
                 organization,
                 entity_id,
-                {"use_ir": use_ir, "build_system": artifact.platform.NAME, "debug_info": get_debug_info}
-            )
-            print(
-                f"Successfully created project #{project_id} with version {version_sequence}: https://app.dedaub.com/projects/{project_id}_{version_sequence}"
-            )
-        else:
-            project_id, version_sequence = await update_project(api_url, api_key, owner_username or organization, name, comment, sources, bytecodes, yul_ir, init_code, git_hash, {"use_ir": use_ir, "build_system": artifact.platform.NAME, "debug_info": get_debug_info})
-            print(
-                f"Successfully updated project #{project_id} with new version {version_sequence}: https://app.dedaub.com/projects/{project_id}_{version_sequence}"
+                {"use_ir": use_ir, "build_system": artifact.platform.NAME, "debug_info": get_debug_info},
+                source_table,
+                content_encoding,
             )
-        print(f"{project_id} {version_sequence}")
-
-    except Exception as e:
-        print(f"Something went wrong with the project: {e}")
-        sys.exit(-1)
+        print(
+            f"Successfully created project #{project_id} with version {version_sequence}: https://app.dedaub.com/projects/{project_id}_{version_sequence}"
+        )
+    else:
+        with phase("upload"):
+            project_id, version_sequence = await client.update_project(owner_username or organization, name, comment, sources, bytecodes, yul_ir, init_code, git_hash, {"use_ir": use_ir, "build_system": artifact.platform.NAME, "debug_info": get_debug_info}, source_table, content_encoding, delta)
+        print(
+            f"Successfully updated project #{project_id} with new version {version_sequence}: https://app.dedaub.com/projects/{project_id}_{version_sequence}"
+        )
+    return project_id, version_sequence
 
 
-async def calc_hash(bytecodes, target):
+async def calc_hash(codehashes, target):
     try:
         git_hash = ''
         git_process = Popen(['git', '-C', os.path.dirname(target), 'rev-parse', 'HEAD'], shell=False, stdout=PIPE,
@@ -144,6 +335,296 @@ async def calc_hash(bytecodes, target):
         print(f"git took too long to answer")
     finally:
         if git_hash == '':
-            bytecode_hashes = b"".join([item.codehash for item in bytecodes])
+            bytecode_hashes = b"".join(codehashes)
             git_hash = sha1(bytecode_hashes).hexdigest()
     return git_hash
+
+
+multi_app = typer.Typer()
+
+
+@multi_app.command()
+def multi(
+    targets: Optional[list[str]] = typer.Argument(None, help="Project directories to upload"),
+    manifest: Optional[pathlib.Path] = typer.Option(
+        None,
+        help="JSON list of targets, given either as paths or as objects with a `target` and optionally their own "
+             "`name`, `framework`, `init`, `organization`, `owner_username` and `comment`"
+    ),
+    framework: Optional[BuildSystem] = FRAMEWORK,
+    cache: bool = CACHE,
+    auto_cache: bool = AUTO_CACHE,
+    init: bool = INIT,
+    organization: str = ORGANIZATION,
+    api_url: str = API_URL,
+    api_key: str = API_KEY,
+    owner_username: str = OWNER_USERNAME,
+    comment: str = COMMENT,
+    use_ir: bool = USE_IR,
+    debug_info: bool = DEBUG_INFO,
+    init_code: bool = INIT_CODE,
+    dedup_sources: bool = DEDUP_SOURCES,
+    content_encoding: ContentEncoding = CONTENT_ENCODING,
+    payload_format: PayloadFormat = PAYLOAD_FORMAT,
+    delta: bool = DELTA,
+    extract_cache: bool = EXTRACT_CACHE,
+    extract_cache_size: int = EXTRACT_CACHE_SIZE,
+    jobs: int = JOBS,
+    compile_jobs: int = typer.Option(2, help="How many targets to compile and extract at the same time"),
+    upload_jobs: int = typer.Option(4, help="How many uploads to run at the same time"),
+    timeout: float = TIMEOUT,
+    retries: int = RETRIES,
+    batch_size: int = BATCH_SIZE,
+    batch_jobs: int = BATCH_JOBS,
+):
+    """
+        Compiles, extracts and uploads several projects, a bounded number at a time, and prints a summary.
+    """
+    import asyncio
+
+    entries: list[dict] = [{"target": target} for target in targets or []]
+    if manifest is not None:
+        with open(manifest) as f:
+            entries += [entry if isinstance(entry, dict) else {"target": entry} for entry in json.load(f)]
+
+    if not entries:
+        print("No targets given, pass them as arguments or through --manifest")
+        sys.exit(-1)
+
+    defaults = {
+        "framework": framework, "init": init, "organization": organization, "owner_username": owner_username,
+        "name": '', "comment": comment,
+    }
+    for entry in entries:
+        for key, value in defaults.items():
+            entry.setdefault(key, value)
+        entry["target"] = os.path.abspath(entry["target"])
+        if isinstance(entry["framework"], str):
+            entry["framework"] = BuildSystem(entry["framework"])
+
+    jobs = jobs or os.cpu_count() or 1
+    extraction_cache = make_extraction_cache(extract_cache_size) if extract_cache else None
+    client = make_client(
+        api_url, api_key, timeout, retries, payload_format, batch_size, batch_jobs, connections=max(upload_jobs, batch_jobs)
+    )
+
+    results = asyncio.run(amulti(
+        entries, client, compile_jobs, upload_jobs, cache, auto_cache, use_ir, debug_info, init_code, dedup_sources, content_encoding,
+        delta, extraction_cache, jobs
+    ))
+
+    print("\nSummary:")
+    for result in results:
+        if result["error"] is None:
+            print(f"  OK      {result['target']}: project #{result['project_id']} version {result['version']} ({result['seconds']:.0f}s)")
+        else:
+            print(f"  FAILED  {result['target']}: {result['error']} ({result['seconds']:.0f}s)")
+
+    failed = sum(result["error"] is not None for result in results)
+    print(f"{len(results) - failed} succeeded, {failed} failed")
+    if failed:
+        sys.exit(-1)
+
+
+async def amulti(
+    entries: list[dict],
+    client: DedaubClient,
+    compile_jobs: int,
+    upload_jobs: int,
+    use_cached_build: bool,
+    auto_cache: bool,
+    use_ir: bool,
+    get_debug_info: bool,
+    get_init_code: bool,
+    dedup_sources: bool,
+    content_encoding: ContentEncoding,
+    delta: bool,
+    extraction_cache: ExtractionCache | None,
+    jobs: int,
+) -> list[dict]:
+    import asyncio
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from srcup.build import compile_build
+
+    from srcup.payload import PayloadSpool, spool_records
+
+    def prepare(entry: dict, spool: PayloadSpool) -> tuple[CryticCompile, dict[str, Any], list[bytes]]:
+        # Each target exports into its own directory, they would overwrite each other's otherwise
+        artifact, extra_fields, *_ = compile_build(
+            entry["target"], use_ir, get_debug_info, entry["framework"], use_cached_build,
+            export_dir=os.path.join(entry["target"], "watchdog"), jobs=jobs, auto_cache=auto_cache
+        )
+        records = iter_contracts(artifact, extra_fields, use_ir, get_debug_info, get_init_code, extraction_cache, jobs)
+        return artifact, *spool_records(records, spool, dedup_sources or (delta and not entry["init"]))
+
+    loop = asyncio.get_running_loop()
+    upload_slots = asyncio.Semaphore(upload_jobs)
+
+    async def run(entry: dict, pool: ThreadPoolExecutor) -> dict:
+        start = time.monotonic()
+        result: dict = {"target": entry["target"], "error": None}
+        try:
+            with PayloadSpool(client.payload_format) as spool:
+                artifact, columns, codehashes = await loop.run_in_executor(pool, prepare, entry, spool)
+                if not codehashes:
+                    raise Exception("Discovered 0 contracts")
+
+                async with upload_slots:
+                    result["project_id"], result["version"] = await upload(
+                        client, artifact, columns, codehashes, entry["target"], use_ir, get_debug_info, entry["init"],
+                        entry["organization"], entry["owner_username"], entry["name"], entry["comment"],
+                        content_encoding, delta
+                    )
+        except Exception as e:
+            result["error"] = str(e) or repr(e)
+        result["seconds"] = time.monotonic() - start
+        return result
+
+    with ThreadPoolExecutor(compile_jobs) as pool:
+        async with client:
+            return await asyncio.gather(*(run(entry, pool) for entry in entries))
+
+
+watch_app = typer.Typer()
+
+
+@watch_app.command()
+def watch(
+    target: str = typer.Argument(..., help="Project directory to watch"),
+    framework: Optional[BuildSystem] = FRAMEWORK,
+    init: bool = typer.Option(False, help="Create the project with the first upload"),
+    organization: str = ORGANIZATION,
+    api_url: str = API_URL,
+    api_key: str = API_KEY,
+    owner_username: str = OWNER_USERNAME,
+    name: str = NAME,
+    comment: str = COMMENT,
+    use_ir: bool = USE_IR,
+    debug_info: bool = DEBUG_INFO,
+    init_code: bool = INIT_CODE,
+    content_encoding: ContentEncoding = CONTENT_ENCODING,
+    payload_format: PayloadFormat = PAYLOAD_FORMAT,
+    extract_cache_size: int = EXTRACT_CACHE_SIZE,
+    jobs: int = JOBS,
+    interval: float = typer.Option(1.0, help="Seconds between two checks of the project files"),
+    debounce: float = typer.Option(5.0, help="Seconds without further changes to wait for before uploading"),
+    timeout: float = TIMEOUT,
+    retries: int = RETRIES,
+    batch_size: int = BATCH_SIZE,
+    batch_jobs: int = BATCH_JOBS,
+):
+    """
+        Uploads the project, then a new version every time its sources or config files change and stay unchanged for
+        --debounce seconds. Builds are incremental, unchanged source units are taken from the extraction cache and
+        only the code and sources the API doesn't already have are uploaded (see --delta). Stop with Ctrl-C.
+    """
+    import asyncio
+
+    target = os.path.abspath(target)
+    jobs = jobs or os.cpu_count() or 1
+    extraction_cache = make_extraction_cache(extract_cache_size)
+    client = make_client(api_url, api_key, timeout, retries, payload_format, batch_size, batch_jobs)
+
+    try:
+        asyncio.run(awatch(
+            target, client, framework, init, organization, owner_username, name, comment, use_ir, debug_info,
+            init_code, content_encoding, extraction_cache, jobs, interval, debounce
+        ))
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+async def awatch(
+    target: str,
+    client: DedaubClient,
+    framework: BuildSystem | None,
+    init: bool,
+    organization: str,
+    owner_username: str,
+    name: str,
+    comment: str,
+    use_ir: bool,
+    get_debug_info: bool,
+    get_init_code: bool,
+    content_encoding: ContentEncoding,
+    extraction_cache: ExtractionCache,
+    jobs: int,
+    interval: float,
+    debounce: float,
+):
+    import asyncio
+
+    from srcup.build import compile_build
+    from srcup.fingerprint import build_sources, files_stamp, source_fingerprint
+    from srcup.payload import PayloadSpool, spool_records
+
+    export_dir = os.path.join(target, "watchdog")
+
+    def prepare(spool: PayloadSpool) -> tuple[CryticCompile, dict[str, Any], list[bytes]]:
+        artifact, extra_fields, *_ = compile_build(
+            target, use_ir, get_debug_info, framework, export_dir=export_dir, jobs=jobs, auto_cache=True,
+        )
+        records = iter_contracts(artifact, extra_fields, use_ir, get_debug_info, get_init_code, extraction_cache, jobs)
+        return artifact, *spool_records(records, spool, True)
+
+    uploaded: str | None = None
+    async with client:
+        while True:
+            sources = build_sources(export_dir, target)
+            # Taken before building, so that changes made in the meantime trigger the next upload
+            stamp = files_stamp(target, sources)
+            if (fingerprint := source_fingerprint(target, {}, sources)) == uploaded:
+                print("No changes to the sources since the last upload")
+            else:
+                try:
+                    with PayloadSpool(client.payload_format) as spool:
+                        artifact, columns, codehashes = await asyncio.to_thread(prepare, spool)
+                        if not codehashes:
+                            raise Exception("Discovered 0 contracts")
+                        await upload(
+                            client, artifact, columns, codehashes, target, use_ir, get_debug_info, init, organization,
+                            owner_username, name, comment, content_encoding, delta=not init
+                        )
+                    uploaded, init = fingerprint, False
+                    # Sources the build used that weren't tracked yet, e.g. outside of the project, are watched from
+                    # now on. Unless tracked files changed during the build, in which case the next round is due anyway
+                    built_sources = build_sources(export_dir, target)
+                    if built_sources != sources and files_stamp(target, sources) == stamp:
+                        sources, stamp = built_sources, files_stamp(target, built_sources)
+                        uploaded = source_fingerprint(target, {}, sources)
+                except Exception as e:
+                    print(f"Upload failed, retrying after the next change: {e}")
+
+            print(f"Watching {target} for changes...")
+            await wait_for_change(target, sources, stamp, interval, debounce)
+
+
+async def wait_for_change(
+    target: str, sources: list[str], stamp: list[tuple[str, int, int]], interval: float, debounce: float
+):
+    """
+        Returns once the project files and `sources` differ from `stamp`, and then stayed the same for `debounce`
+        seconds.
+    """
+    import asyncio
+    import time
+
+    from srcup.fingerprint import files_stamp
+
+    while (current := files_stamp(target, sources)) == stamp:
+        await asyncio.sleep(interval)
+
+    changed = time.monotonic()
+    while time.monotonic() - changed < debounce:
+        await asyncio.sleep(min(interval, debounce))
+        if (latest := files_stamp(target, sources)) != current:
+            current, changed = latest, time.monotonic()
+
+
+# Commands that are dispatched on the first argument, `srcup <target>` keeps running `single`
+SUBCOMMANDS = {
+    "multi": multi_app,
+    "watch": watch_app,
+}
@@ -1,9 +1,22 @@
+import json
 import os
+from contextlib import contextmanager
 from pathlib import Path
 import subprocess
+from typing import Any, Iterator
+
+from crytic_compile.platform.exceptions import InvalidCompilation
+from crytic_compile.platform.foundry import Foundry, _get_forge_version
 
 import srcup.constants
 
+# Build outputs srcup keeps for itself inside the project, so that they are reused between runs
+SRCUP_DIRECTORY = ".srcup"
+HARDHAT_DIRECTORY = Path(SRCUP_DIRECTORY, "hardhat")
+FOUNDRY_DIRECTORY = Path(SRCUP_DIRECTORY, "foundry")
+HARDHAT_PATHS_FILE = "paths.json"
+
+
 def find_hardhat_config(target: str) -> str | None:
     for candidate in ("hardhat.config.js", "hardhat.config.ts", "hardhat.config.cjs"):
         if os.path.isfile(os.path.join(target, candidate)):
@@ -12,50 +25,142 @@ def find_hardhat_config(target: str) -> str | None:
     return None
 
 
-def handle_hardhat_config(build_path: str, use_ir: bool) -> tuple[Path, str] | None:
-    if (config := find_hardhat_config(build_path)) is None:
-        print("Can't locate hardhat config file")
-        return None
+def _srcup_directory(build_path: str) -> Path:
+    directory = Path(build_path, SRCUP_DIRECTORY)
+    directory.mkdir(exist_ok=True)
+    # Keeps the directory out of the project's version control without touching its .gitignore
+    if not (gitignore := directory / ".gitignore").is_file():
+        gitignore.write_text("*\n")
+    return directory
 
-    config_path = Path(build_path, config)
 
-    if not config_path.is_file():
+def write_hardhat_config(build_path: str, use_ir: bool) -> Path | None:
+    """
+        Writes `.srcup/hardhat/hardhat.config.<ext>`, which loads the project's config, adds the compiler outputs
+        srcup needs (`constants.get_extra_config`) and points the artifacts and cache to `.srcup/hardhat`. Hardhat
+        runs with it also save the resolved paths to `.srcup/hardhat/paths.json`, see `hardhat_working_dir`.
+        The project's config and cache are left alone, and the srcup cache stays valid from one run to the next.
+    """
+    if (config := find_hardhat_config(build_path)) is None:
         print("Can't locate hardhat config file")
         return None
 
-    with open(config_path) as f:
-        original_config = f.read()
-
-    with open(config_path, "a") as f:
-        extra_config = srcup.constants.get_extra_config(use_ir)
-        f.write(extra_config)
-
-    return config_path, original_config
-
-
-def handle_foundry_config(build_path: str, use_ir: bool) -> tuple[Path, str] | None:
-    if not use_ir:
+    directory = (_srcup_directory(build_path) / "hardhat").resolve()
+    directory.mkdir(exist_ok=True)
+
+    # Same extension as the project's config, so that Hardhat loads it (and what it requires) the same way
+    config_path = directory / config
+    content = (
+        "// Generated by srcup, changes are overwritten\n"
+        f"module.exports = require({json.dumps(str(Path(build_path, config).resolve()))});\n"
+        + srcup.constants.get_extra_config(use_ir)
+        + "\nconst srcupPaths = base.paths ?? {};\n"
+        # Relative paths of the project's config are resolved from its own directory, not from this one
+        + f"base.paths = {{...srcupPaths, root: require('path').resolve({json.dumps(str(Path(build_path).resolve()))}, srcupPaths.root ?? '.'),"
+        + f" artifacts: {json.dumps(str(directory / 'artifacts'))}, cache: {json.dumps(str(directory / 'cache'))}}};\n"
+        + f"require('fs').writeFileSync({json.dumps(str(directory / HARDHAT_PATHS_FILE))}, JSON.stringify(base.paths));\n"
+    )
+
+    # Left as is when unchanged, Hardhat doesn't need to see a new config file every run
+    if not config_path.is_file() or config_path.read_text() != content:
+        config_path.write_text(content)
+    return config_path
+
+
+def reusable_artifacts(build_path: str, srcup_artifacts: Path, project_artifacts: str) -> Path | None:
+    """
+        `srcup_artifacts`, from the last build srcup made itself, if its build-info is at least as recent as the
+        one in the project's own `project_artifacts`.
+    """
+    srcup_build_info = Path(build_path, srcup_artifacts, "build-info")
+    project_build_info = Path(build_path, project_artifacts, "build-info")
+    if not srcup_build_info.is_dir():
         return None
-
-    config_path = Path(build_path, "foundry.toml")
-
-    if not config_path.is_file():
-        print("Can't locate foundry config file")
+    if project_build_info.is_dir() and project_build_info.stat().st_mtime > srcup_build_info.stat().st_mtime:
         return None
-
-    with open(config_path, "r") as f:
-        original_config = f.read()
-
-    extra_config = subprocess.run(
-        ["forge", "config", "--extra-output-files", "irOptimized"],
-        cwd=build_path,
-        stdout=subprocess.PIPE,
-        check=True
-    ).stdout.decode("utf8")
-
-    with open(config_path, "w") as f:
-        f.write(extra_config)
-
-    return config_path, original_config
-
-
+    return srcup_build_info.parent
+
+
+def hardhat_working_dir(build_path: str) -> dict[str, str]:
+    # The project root as resolved by the last Hardhat run with the config of `write_hardhat_config`, as the
+    # crytic-compile argument that overrides it
+    try:
+        with open(Path(build_path, HARDHAT_DIRECTORY, HARDHAT_PATHS_FILE)) as f:
+            return {"hardhat_working_dir": json.load(f)["root"]}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+@contextmanager
+def handle_hardhat_config(build_path: str, use_ir: bool, ignore_compile: bool) -> Iterator[dict[str, Any]]:
+    """
+        Yields the crytic-compile arguments that read the build made with `write_hardhat_config`. Unless
+        `ignore_compile`, the project is compiled first: incrementally, unlike crytic-compile's `compile --force`.
+    """
+    if ignore_compile:
+        artifacts = reusable_artifacts(build_path, HARDHAT_DIRECTORY / "artifacts", "artifacts")
+        if artifacts is None:
+            yield {}
+        else:
+            yield {"hardhat_artifacts_directory": str(artifacts), **hardhat_working_dir(build_path)}
+        return
+
+    if (config_path := write_hardhat_config(build_path, use_ir)) is None:
+        yield {}
+        return
+
+    if subprocess.run(
+        ["npx", "hardhat", "compile"], cwd=build_path, env={**os.environ, "HARDHAT_CONFIG": str(config_path)}
+    ).returncode != 0:
+        raise InvalidCompilation("hardhat compile failed, see its output above")
+
+    # Every path crytic-compile would otherwise read from the project's own config, through the Hardhat console.
+    # The environment is left alone: projects may be built from several threads at once
+    yield {
+        "hardhat_ignore_compile": True,
+        "hardhat_artifacts_directory": str(config_path.parent / "artifacts"),
+        "hardhat_cache_directory": str(config_path.parent / "cache"),
+        **hardhat_working_dir(build_path),
+    }
+
+
+@contextmanager
+def handle_foundry_config(build_path: str, use_ir: bool, ignore_compile: bool) -> Iterator[dict[str, Any]]:
+    """
+        Builds the project with forge, which adds the outputs srcup needs through environment variables rather than
+        `foundry.toml`, and writes the build to `.srcup/foundry` instead of `out/`. The project's config and cache
+        are left alone, and the srcup cache stays valid from one run to the next, so builds are incremental.
+        Yields the crytic-compile arguments that read that build.
+    """
+    if ignore_compile:
+        artifacts = reusable_artifacts(build_path, FOUNDRY_DIRECTORY / "out", "out")
+        yield {"foundry_out_directory": str(artifacts)} if artifacts is not None else {}
+        return
+
+    directory = (_srcup_directory(build_path) / "foundry").resolve()
+    # Foundry's default output selection has the immutable references but not the debug data
+    extra_output = ["evm.deployedBytecode.functionDebugData"] + (["irOptimized"] if use_ir else [])
+    variables = {
+        "FOUNDRY_OUT": str(directory / "out"),
+        "FOUNDRY_BUILD_INFO_PATH": str(directory / "out" / "build-info"),
+        "FOUNDRY_CACHE_PATH": str(directory / "cache"),
+        "FOUNDRY_EXTRA_OUTPUT": json.dumps(extra_output),
+        # As set by crytic-compile
+        "FOUNDRY_DYNAMIC_TEST_LINKING": "false",
+    }
+    if use_ir:
+        variables["FOUNDRY_EXTRA_OUTPUT_FILES"] = json.dumps(["irOptimized"])
+
+    # The same command crytic-compile runs, with its own copy of the environment rather than variables set in
+    # os.environ: projects may be built from several threads at once
+    command = ["forge", "build", "--build-info"]
+    if (forge_version := _get_forge_version()) and forge_version >= (1, 4, 0):
+        command += ["--deny", "never"]
+    project_root = Foundry.locate_project_root(build_path) or Path(build_path)
+    if not project_root.samefile(build_path):
+        command.append(str(Path(build_path).resolve().relative_to(project_root)))
+    if subprocess.run(command, cwd=project_root, env={**os.environ, **variables}).returncode != 0:
+        raise InvalidCompilation("forge build failed, see its output above")
+
+    # crytic-compile only reads the build, so it doesn't run `forge clean`, which would empty the srcup cache either
+    yield {"foundry_ignore_compile": True, "foundry_out_directory": variables["FOUNDRY_OUT"]}
@@ -1,3 +1,42 @@
+from enum import Enum
+
+
+class BuildSystem(Enum):
+    # ARCHIVE = "Archive"
+    BROWNIE = "Brownie"
+    # BUIDLER = "Buidler"
+    # DAPP = "Dapp"
+    # EMBARK = "Embark"
+    # ETHERLIME = "Etherlime"
+    # ETHERSCAN = "Etherscan"
+    HARDHAT = "Hardhat"
+    SOLC = "Solc"
+    # SOLC_STANDARD_JSON = "SolcStandardJson"
+    STANDARD = "Standard"
+    TRUFFLE = "Truffle"
+    VYPER = "Vyper"
+    # WAFFLE = "Waffle"
+    FOUNDRY = "Foundry"
+
+
+class ContentEncoding(Enum):
+    IDENTITY = "identity"
+    GZIP = "gzip"
+    ZSTD = "zstd"
+
+
+class PayloadFormat(Enum):
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+class ArchiveCompression(Enum):
+    LZMA = "lzma"
+    DEFLATED = "deflated"
+    BZIP2 = "bzip2"
+    STORED = "stored"
+
+
 def get_extra_config(use_ir: bool):
     return f"""
 const patchIr = {str(use_ir).lower()};
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 
-from hashlib import md5
+from hashlib import md5, sha256
 import json
-from typing import cast
+from typing import Generator, Iterable, Iterator, cast
 
 from crytic_compile.compilation_unit import CompilationUnit
 from crytic_compile.crytic_compile import CryticCompile
@@ -10,8 +10,18 @@ from crytic_compile.platform.types import Type
 from crytic_compile.source_unit import SourceUnit
 from eth_hash.auto import keccak
 
+import itertools
+import multiprocessing
 import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from .cache import ExtractionCache
 from .models import ContractBytecode, ContractInitCode, ContractSource, HexBytes, YulIRCode
+from .srcmap import generate_remapping, remap_source_map  # noqa: F401
+from .utils import can_fork
+
+
+ContractRecord = tuple[ContractSource, ContractBytecode, YulIRCode | None, ContractInitCode | None]
 
 
 def handle_type(input: dict) -> str:
@@ -26,6 +36,41 @@ def construct_signature(abi: dict) -> str:
     return f'{abi["name"]}({",".join(map(handle_type, abi["inputs"]))})'
 
 
+# keccak of canonical signatures, shared by every contract (interfaces and inherited functions repeat a lot)
+_signature_hashes: dict[str, bytes] = {}
+
+SELECTOR_TYPES = ("function", "event", "error")
+
+
+def signature_hash(signature: str) -> bytes:
+    if (digest := _signature_hashes.get(signature)) is None:
+        digest = _signature_hashes[signature] = keccak(signature.encode())
+    return digest
+
+
+def compute_selectors(abi: list[dict]) -> dict[str, list[tuple[str, bytes]]]:
+    """
+        Single pass over the ABI, returns the (signature, selector) pairs of each of the `SELECTOR_TYPES`.
+        Function and error selectors are 4 bytes long, event topics the whole 32 bytes.
+    """
+    selectors: dict[str, list[tuple[str, bytes]]] = {kind: [] for kind in SELECTOR_TYPES}
+    for entry in abi:
+        if (kind := entry.get("type")) not in selectors:
+            continue
+        signature = construct_signature(entry)
+        digest = signature_hash(signature)
+        selectors[kind].append((signature, digest if kind == "event" else digest[:4]))
+    return selectors
+
+
+def selector_table(contracts: Iterable[ContractRecord]) -> dict[str, dict[str, str]]:
+    table: dict[str, dict[str, str]] = {kind: {} for kind in SELECTOR_TYPES}
+    for src, *_ in contracts:
+        for kind, selectors in compute_selectors(src.json_abi).items():
+            table[kind].update((signature, "0x" + selector.hex()) for signature, selector in selectors)
+    return {kind: dict(sorted(selectors.items())) for kind, selectors in table.items()}
+
+
 def create_file_mapping(comp_unit: CompilationUnit) -> dict[str, SourceUnit]:
     files: dict[str, SourceUnit] = {}
     for source_unit in comp_unit.source_units.values():
@@ -65,14 +110,13 @@ def remap_srcmap(src_map: list[str], remapping: dict[str, str]):
     return remapped_src_map
 
 
-def generate_remapping(references: list[str], file_ids: set[str]) -> dict[str, str]:
-    return {
-        v: str(k) if v in file_ids else "-1"
-        for k, v in enumerate(
-            references,
-            start=-1 if len(references) and references[0] == "-1" else 0,
-        )
-    }
+def ir_output_filename(artifact: CryticCompile, source_unit: SourceUnit, contract_name: str) -> str | None:
+    # Where the build system writes the optimized IR, for the ones that don't report it in their build-info
+    # (Foundry's `.iropt` files are indexed by `build.get_foundry_extra_fields` instead)
+    if artifact.platform.TYPE == Type.SOLC:
+        return os.path.join(artifact.working_dir, contract_name + "_opt.yul")
+    return None
+
 
 def extract_extra_fields(
     md5_bytecode: bytes,
@@ -88,8 +132,8 @@ def extract_extra_fields(
     if not get_debug_info and not use_ir:
         return im_ref, debug_info, yul_ir
 
-    # If we are building with Hardhat, we can extract the extra fields
-    if artifact.platform.TYPE == Type.HARDHAT:
+    # Hardhat and Foundry report the extra fields in their build-info
+    if artifact.platform.TYPE in (Type.HARDHAT, Type.FOUNDRY):
         extra_fields_of_file = extra_fields.get(source_unit.filename.absolute)
 
         if extra_fields_of_file:
@@ -103,18 +147,13 @@ def extract_extra_fields(
     # Try and extract yul
     yul_code = None
     if artifact.platform.TYPE == Type.FOUNDRY:
-        output_dir = os.path.join(artifact.working_dir, "out")
-        filename_only = source_unit.filename.short.split("/")[-1]
-        contract_output = contract_name + ".iropt"
-        optimized_ir_filename = os.path.join(output_dir, filename_only, contract_output)
-
-        if os.path.isfile(optimized_ir_filename):
-            with open(optimized_ir_filename, "r") as f:
-                yul_code = f.read()
+        extra_fields_of_file = extra_fields.get(source_unit.filename.absolute)
+        if extra_fields_of_file and (raw_yul_code := extra_fields_of_file.contract_to_ir.get(contract_name)):
+            yul_code = raw_yul_code
         else:
             print(f"Could not find IR optimized output for {contract_name}")
     elif artifact.platform.TYPE == Type.SOLC:
-        optimized_ir_filename = os.path.join(artifact.working_dir, contract_name+"_opt.yul")
+        optimized_ir_filename = cast(str, ir_output_filename(artifact, source_unit, contract_name))
         with open(optimized_ir_filename, "r") as f:
             yul_code = f.read()
     elif artifact.platform.TYPE == Type.HARDHAT:
@@ -134,91 +173,315 @@ def extract_extra_fields(
 
 
 
-def process(
+def runtime_bytecode_hex(source_unit: SourceUnit, contract_name: str) -> str:
+    # Library placeholders are linked to the zero address
+    return source_unit.bytecode_runtime(contract_name, {k: 0 for k, v in source_unit.libraries[contract_name]})
+
+
+def find_duplicates(source_units: Iterable[SourceUnit]) -> tuple[list[frozenset[str]], list[dict[str, str]]]:
+    """
+        For each source unit, the contracts that an earlier source unit already produced: same runtime bytecode,
+        path and name. Projects compiled with several solc versions (or Foundry's `compile_all`) have the same
+        contract in several compilation units, which only needs to be extracted and uploaded once.
+        Also returns the `runtime_bytecode_hex` of the contracts of each source unit, which linking makes costly.
+    """
+    seen: set[tuple[bytes, str, str]] = set()
+    duplicates: list[frozenset[str]] = []
+    bytecodes: list[dict[str, str]] = []
+    for source_unit in source_units:
+        names = set()
+        hex_bytecodes = {}
+        for contract_name in source_unit.contracts_names:
+            hex_runtime_bytecode = hex_bytecodes[contract_name] = runtime_bytecode_hex(source_unit, contract_name)
+            if not hex_runtime_bytecode:
+                continue
+            # Hashing the hex is enough to tell bytecodes apart, without decoding it
+            key = (md5(hex_runtime_bytecode.encode()).digest(), source_unit.filename.short, contract_name)
+            if key in seen:
+                names.add(contract_name)
+            else:
+                seen.add(key)
+        duplicates.append(frozenset(names))
+        bytecodes.append(hex_bytecodes)
+    return duplicates, bytecodes
+
+
+def process_source_unit(
     artifact: CryticCompile,
+    source_unit: SourceUnit,
+    file_mapping: dict[str, SourceUnit],
     extra_fields: dict,
     use_ir: bool,
     get_debug_info: bool,
-    get_init_code: bool
-) -> list[tuple[ContractSource, ContractBytecode, YulIRCode | None, ContractInitCode | None]]:
-    contracts: list[tuple[ContractSource, ContractBytecode, YulIRCode | None, ContractInitCode | None]] = []
+    get_init_code: bool,
+    skipped: frozenset[str] = frozenset(),
+    bytecodes: dict[str, str] | None = None,
+) -> list[ContractRecord]:
+    """
+        Extracts the contracts of `source_unit`, except for the `skipped` ones. `bytecodes` has their
+        `runtime_bytecode_hex` if it is already known, see `find_duplicates`.
+    """
+    contracts: list[ContractRecord] = []
+    file_ids = frozenset(file_mapping.keys())
+
+    for contract_name in source_unit.contracts_names:
+        if contract_name in skipped:
+            continue
 
-    for comp_unit in artifact.compilation_units.values():
-        file_mapping = create_file_mapping(comp_unit)
-        for source_unit in comp_unit.source_units.values():
-            for contract_name in source_unit.contracts_names:
-                if (
-                    hex_runtime_bytecode := source_unit.bytecode_runtime(
-                        contract_name,
-                        {k: 0 for k, v in source_unit.libraries[contract_name]},
-                    )
-                ) == "":
-                    continue
-
-
-                src_map = source_unit.srcmap_runtime(contract_name)
-                references = get_referenced_sources(src_map)
-                ref_remap = generate_remapping(references, set(file_mapping.keys()))
-                remapped_srcmap = remap_srcmap(src_map, ref_remap)
-                sources = [
-                    file
-                    for k in references
-                    if (file := file_mapping.get(k)) is not None
-                ]
-
-                runtime_bytecode = bytes.fromhex(hex_runtime_bytecode)
-
-                md5_bytecode = md5(runtime_bytecode).digest()
-
-                im_ref, debug_info, yul_ir = extract_extra_fields(md5_bytecode, contract_name, source_unit, artifact, extra_fields, use_ir, get_debug_info)
-
-                src = ContractSource(
-                    contract_name=contract_name,
-                    contract_path=source_unit.filename.short,
-                    array_source_names=[source.filename.short for source in sources],
-                    array_source_level=[
-                        artifact.src_content[source.filename.absolute]
-                        for source in sources
-                    ],
-                    md5_bytecode=HexBytes(md5_bytecode),
-                    source_map=";".join(remapped_srcmap),
-                    json_abi=cast(list[dict], source_unit.abi(contract_name)),
-                    array_function_selectors=[
-                        HexBytes(keccak(construct_signature(abi).encode())[:4])
-                        for abi in source_unit.abi(contract_name)
-                        if abi["type"] == "function"
-                    ],
-                    array_event_selectors=[
-                        HexBytes(keccak(construct_signature(abi).encode()))
-                        for abi in source_unit.abi(contract_name)
-                        if abi["type"] == "event"
-                    ],
-                    array_error_selectors=[
-                        HexBytes(keccak(construct_signature(abi).encode())[:4])
-                        for abi in source_unit.abi(contract_name)
-                        if abi["type"] == "error"
-                    ],
-                    json_immutable_references=im_ref,
-                    json_function_debug_info=debug_info,
-                )
-                bytecode = ContractBytecode(
+        hex_runtime_bytecode = (
+            bytecodes[contract_name] if bytecodes is not None else runtime_bytecode_hex(source_unit, contract_name)
+        )
+        if hex_runtime_bytecode == "":
+            continue
+
+
+        references, remapped_srcmap = remap_source_map(";".join(source_unit.srcmap_runtime(contract_name)), file_ids)
+        sources = [
+            file
+            for k in references
+            if (file := file_mapping.get(k)) is not None
+        ]
+
+        runtime_bytecode = bytes.fromhex(hex_runtime_bytecode)
+
+        md5_bytecode = md5(runtime_bytecode).digest()
+
+        im_ref, debug_info, yul_ir = extract_extra_fields(md5_bytecode, contract_name, source_unit, artifact, extra_fields, use_ir, get_debug_info)
+
+        abi = cast(list[dict], source_unit.abi(contract_name))
+        selectors = compute_selectors(abi)
+
+        src = ContractSource(
+            contract_name=contract_name,
+            contract_path=source_unit.filename.short,
+            array_source_names=[source.filename.short for source in sources],
+            array_source_level=[
+                artifact.src_content[source.filename.absolute]
+                for source in sources
+            ],
+            md5_bytecode=HexBytes(md5_bytecode),
+            source_map=remapped_srcmap,
+            json_abi=abi,
+            array_function_selectors=[HexBytes(selector) for _, selector in selectors["function"]],
+            array_event_selectors=[HexBytes(selector) for _, selector in selectors["event"]],
+            array_error_selectors=[HexBytes(selector) for _, selector in selectors["error"]],
+            json_immutable_references=im_ref,
+            json_function_debug_info=debug_info,
+        )
+        bytecode = ContractBytecode(
+            md5_bytecode=HexBytes(md5_bytecode),
+            codehash=HexBytes(keccak(runtime_bytecode)),
+            bytecode=HexBytes(runtime_bytecode),
+        )
+
+        init_code = None
+        if get_init_code and (hex_init_code := source_unit.bytecode_init(contract_name)):
+            try:
+                init_code_bytes = bytes.fromhex(hex_init_code)
+                init_code = ContractInitCode(
                     md5_bytecode=HexBytes(md5_bytecode),
-                    codehash=HexBytes(keccak(runtime_bytecode)),
-                    bytecode=HexBytes(runtime_bytecode),
+                    init_code=HexBytes(init_code_bytes),
                 )
+            except ValueError:
+                print(f"WARNING: Malformed init code for {src.contract_path}: {src.contract_name}")
 
-                init_code = None
-                if get_init_code and (hex_init_code := source_unit.bytecode_init(contract_name)):
-                    try:
-                        init_code_bytes = bytes.fromhex(hex_init_code)
-                        init_code = ContractInitCode(
-                            md5_bytecode=HexBytes(md5_bytecode),
-                            init_code=HexBytes(init_code_bytes),
-                        )
-                    except ValueError:
-                        print(f"WARNING: Malformed init code for {src.contract_path}: {src.contract_name}")
-
-                contracts.append((src, bytecode, yul_ir, init_code))
+        contracts.append((src, bytecode, yul_ir, init_code))
 
     return contracts
 
+
+def source_unit_fingerprint(
+    artifact: CryticCompile,
+    source_unit: SourceUnit,
+    file_mapping: dict[str, SourceUnit],
+    extra_fields: dict,
+    use_ir: bool,
+    get_debug_info: bool,
+    get_init_code: bool,
+    skipped: frozenset[str] = frozenset(),
+    bytecodes: dict[str, str] | None = None,
+) -> str:
+    """
+        Hash of everything `process_source_unit` reads, except for the source contents themselves
+        which are stripped from cached records and restored from the artifact.
+    """
+    h = sha256()
+
+    def update(*values):
+        for value in values:
+            h.update(json.dumps(value, sort_keys=True, default=str).encode())
+
+    update(artifact.platform.NAME, use_ir, get_debug_info, get_init_code, source_unit.filename.short)
+    update(sorted((k, v.filename.short, v.filename.absolute) for k, v in file_mapping.items()))
+    if skipped:
+        update(sorted(skipped))
+
+    if (extra_fields_of_file := extra_fields.get(source_unit.filename.absolute)) is not None:
+        update(
+            extra_fields_of_file.contract_to_ir,
+            extra_fields_of_file.contract_to_im_ref,
+            extra_fields_of_file.contract_to_debug_info,
+        )
+
+    for contract_name in source_unit.contracts_names:
+        update(
+            contract_name,
+            bytecodes[contract_name] if bytecodes is not None else runtime_bytecode_hex(source_unit, contract_name),
+            source_unit.srcmap_runtime(contract_name),
+            source_unit.abi(contract_name),
+        )
+        if get_init_code:
+            update(source_unit.bytecode_init(contract_name))
+        if use_ir and (ir_file := ir_output_filename(artifact, source_unit, contract_name)) and os.path.isfile(ir_file):
+            stat = os.stat(ir_file)
+            update(ir_file, stat.st_size, stat.st_mtime_ns)
+
+    return h.hexdigest()
+
+
+def _strip_source_contents(records: list[ContractRecord]) -> list[ContractRecord]:
+    return [(src.model_copy(update={"array_source_level": []}), *rest) for src, *rest in records]  # type: ignore
+
+
+def _restore_source_contents(
+    records: list[ContractRecord], artifact: CryticCompile, file_mapping: dict[str, SourceUnit]
+) -> list[ContractRecord]:
+    short_to_absolute = {v.filename.short: v.filename.absolute for v in file_mapping.values()}
+    for src, *_ in records:
+        src.array_source_level = [artifact.src_content[short_to_absolute[name]] for name in src.array_source_names]
+    return records
+
+
+# State shared with the extraction workers, inherited by forking instead of being pickled for every task.
+# Keyed per `process` call, so that several projects can be extracted at the same time.
+_extraction_states: dict[int, tuple] = {}
+_extraction_ids = itertools.count()
+
+# Source units per task sent to the extraction workers
+MAX_CHUNK_SIZE = 4
+
+
+def _extract_unit(task: tuple[int, int]) -> list[ContractRecord]:
+    state_id, index = task
+    state = _extraction_states[state_id]
+    artifact, units, duplicates, bytecodes, extra_fields, use_ir, get_debug_info, get_init_code = state
+    source_unit, file_mapping = units[index]
+    # Sources are dropped before the records are sent back and restored by the caller
+    return _strip_source_contents(
+        process_source_unit(
+            artifact, source_unit, file_mapping, extra_fields, use_ir, get_debug_info, get_init_code, duplicates[index],
+            bytecodes[index],
+        )
+    )
+
+
+def _extract_chunk(tasks: list[tuple[int, int]]) -> list[list[ContractRecord]]:
+    return [_extract_unit(task) for task in tasks]
+
+
+def _extract_units(state_id: int, indices: list[int], jobs: int) -> Generator[list[ContractRecord], None, None]:
+    tasks = [(state_id, i) for i in indices]
+    if jobs <= 1 or len(tasks) <= 1:
+        yield from map(_extract_unit, tasks)
+        return
+
+    executor: Executor
+    if can_fork():
+        executor = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork"))
+    else:
+        # No cheap way to hand the artifact over to spawned processes, threads still overlap the I/O and hashing
+        print(f"Other threads are running, extracting with {jobs} threads instead of processes")
+        executor = ThreadPoolExecutor(jobs)
+
+    # Chunks of source units, of which only a bounded window is in flight: results that the consumer (serialization,
+    # upload) hasn't taken yet don't pile up
+    chunk_size = max(1, min(len(tasks) // (jobs * 4), MAX_CHUNK_SIZE))
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    pending: deque[Future[list[list[ContractRecord]]]] = deque()
+    with executor:
+        try:
+            for chunk in chunks:
+                if len(pending) >= jobs * 2:
+                    yield from pending.popleft().result()
+                pending.append(executor.submit(_extract_chunk, chunk))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def iter_process(
+    artifact: CryticCompile,
+    extra_fields: dict,
+    use_ir: bool,
+    get_debug_info: bool,
+    get_init_code: bool,
+    cache: ExtractionCache | None = None,
+    jobs: int = 1,
+) -> Iterator[ContractRecord]:
+    """
+        Extracts the contracts of every source unit, `jobs` source units at a time, and yields them
+        in compilation unit / source unit order regardless of `jobs`. Only the records of the source units
+        that are being extracted or waiting their turn are held in memory.
+        Contracts that several compilation units produced identically are only extracted once, see `find_duplicates`.
+    """
+    units: list[tuple[SourceUnit, dict[str, SourceUnit]]] = []
+    for comp_unit in artifact.compilation_units.values():
+        file_mapping = create_file_mapping(comp_unit)
+        units.extend((source_unit, file_mapping) for source_unit in comp_unit.source_units.values())
+
+    duplicates, bytecodes = find_duplicates(source_unit for source_unit, _ in units)
+    if skipped := sum(len(names) for names in duplicates):
+        print(f"Skipping {skipped} duplicate contracts compiled identically in several compilation units")
+
+    keys: list[str] = [""] * len(units)
+    pending: list[int] = []
+
+    for i, (source_unit, file_mapping) in enumerate(units):
+        if cache is not None:
+            keys[i] = source_unit_fingerprint(
+                artifact, source_unit, file_mapping, extra_fields, use_ir, get_debug_info, get_init_code, duplicates[i],
+                bytecodes[i],
+            )
+            if cache.has(keys[i]):
+                continue
+        pending.append(i)
+
+    state_id = next(_extraction_ids)
+    _extraction_states[state_id] = (
+        artifact, units, duplicates, bytecodes, extra_fields, use_ir, get_debug_info, get_init_code
+    )
+    extracted = _extract_units(state_id, pending, jobs)
+    pending_set = set(pending)
+    try:
+        for i, (_, file_mapping) in enumerate(units):
+            if i in pending_set:
+                records = next(extracted)
+            elif cache is not None and (cached := cache.get(keys[i])) is not None:
+                yield from _restore_source_contents(cached, artifact, file_mapping)
+                continue
+            else:
+                # Evicted since it was looked up
+                records = _extract_unit((state_id, i))
+
+            if cache is not None:
+                cache.put(keys[i], records)
+            yield from _restore_source_contents(records, artifact, file_mapping)
+    finally:
+        extracted.close()
+        del _extraction_states[state_id]
+        if cache is not None:
+            cache.evict()
+
+
+def process(
+    artifact: CryticCompile,
+    extra_fields: dict,
+    use_ir: bool,
+    get_debug_info: bool,
+    get_init_code: bool,
+    cache: ExtractionCache | None = None,
+    jobs: int = 1,
+) -> list[ContractRecord]:
+    return list(iter_process(artifact, extra_fields, use_ir, get_debug_info, get_init_code, cache, jobs))
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterable
+
+FINGERPRINTS_FILE = "fingerprints.json"
+
+SOURCE_EXTENSIONS = (".sol", ".vy", ".vyi", ".yul")
+
+# Files that change how a project is built without being sources themselves
+CONFIG_FILES = (
+    "hardhat.config.js", "hardhat.config.ts", "hardhat.config.cjs",
+    "foundry.toml", "remappings.txt",
+    "truffle-config.js", "truffle.js", "brownie-config.yaml", "ape-config.yaml",
+    "package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "bun.lockb",
+)
+
+# Dependencies, version control and srcup's own outputs, skipped at any depth. The sources a build imports from
+# them, or from outside of the project, are tracked through the sources of the previous build, see `build_sources`
+SKIPPED_DIRECTORIES = {".git", "node_modules", "watchdog", "crytic-export", ".srcup", "__pycache__"}
+
+# The default build outputs and caches of the supported build systems, only skipped at the root of the project
+BUILD_DIRECTORIES = {"artifacts", "cache", "out", "build", "typechain", "typechain-types"}
+
+# Where the supported build systems keep the artifacts that a cached build is read from
+ARTIFACT_DIRECTORIES = (
+    "artifacts/build-info", ".srcup/hardhat/artifacts/build-info", "out/build-info", ".srcup/foundry/out/build-info",
+    "build/contracts", "crytic-export",
+)
+
+ENV_PREFIXES = ("FOUNDRY_", "DAPP_", "HARDHAT_")
+
+
+def project_files(target: str) -> list[str]:
+    # The source and config files of the project, sorted
+    files = []
+    for root, dirs, filenames in os.walk(target):
+        skipped = SKIPPED_DIRECTORIES | BUILD_DIRECTORIES if root == target else SKIPPED_DIRECTORIES
+        dirs[:] = [d for d in dirs if d not in skipped]
+        for filename in filenames:
+            if filename.endswith(SOURCE_EXTENSIONS) or filename in CONFIG_FILES:
+                files.append(os.path.join(root, filename))
+    return sorted(files)
+
+
+def tracked_files(target: str, sources: Iterable[str] = ()) -> list[str]:
+    # The project files together with `sources`, absolute and sorted
+    return sorted({os.path.abspath(path) for path in project_files(target)}.union(sources))
+
+
+def source_fingerprint(target: str, settings: dict[str, Any], sources: Iterable[str] = ()) -> str:
+    """
+        Hashes the contents of every source and config file of the project and of the `sources` of its previous
+        build, together with the build `settings` and the build-system environment variables. Paths are hashed
+        relative to `target`.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    digest.update(json.dumps(sorted((k, v) for k, v in os.environ.items() if k.startswith(ENV_PREFIXES))).encode())
+
+    for path in tracked_files(target, sources):
+        digest.update(os.path.relpath(path, target).encode() + b"\0")
+        try:
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except OSError:
+            digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+def files_stamp(target: str, sources: Iterable[str] = ()) -> list[tuple[str, int, int]]:
+    """
+        Cheap listing of the project's source and config files and of `sources`, by size and modification time, to
+        poll for changes.
+    """
+    stamp = []
+    for path in tracked_files(target, sources):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stamp.append((os.path.relpath(path, target), stat.st_size, stat.st_mtime_ns))
+    return stamp
+
+
+def artifacts_stamp(target: str) -> list[tuple[str, int, int]]:
+    """
+        Cheap listing of the build artifacts, so that artifacts rebuilt or removed outside of srcup are noticed.
+    """
+    stamp = []
+    for directory in ARTIFACT_DIRECTORIES:
+        path = Path(target, directory)
+        if not path.is_dir():
+            continue
+        for entry in os.scandir(path):
+            if entry.is_file():
+                stat = entry.stat()
+                stamp.append((f"{directory}/{entry.name}", stat.st_size, stat.st_mtime_ns))
+    return sorted(stamp)
+
+
+def _load(export_dir: str) -> dict[str, Any]:
+    try:
+        with open(Path(export_dir, FINGERPRINTS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_sources(export_dir: str, target: str) -> list[str]:
+    # The absolute paths of the sources used by the previous build of `target`
+    return _load(export_dir).get(target, {}).get("sources", [])
+
+
+def is_unchanged(export_dir: str, target: str, fingerprint: str) -> bool:
+    recorded = _load(export_dir).get(target)
+    if not recorded or recorded.get("fingerprint") != fingerprint:
+        return False
+    # JSON turns the tuples into lists
+    return bool(recorded["artifacts"]) and recorded["artifacts"] == [list(x) for x in artifacts_stamp(target)]
+
+
+def record(export_dir: str, target: str, fingerprint: str | None, sources: list[str]):
+    fingerprints = _load(export_dir)
+    fingerprints[target] = {"fingerprint": fingerprint, "artifacts": artifacts_stamp(target), "sources": sources}
+
+    os.makedirs(export_dir, exist_ok=True)
+    tmp_path = Path(export_dir, FINGERPRINTS_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(fingerprints, f, indent=2)
+    os.replace(tmp_path, Path(export_dir, FINGERPRINTS_FILE))
@@ -1,10 +1,12 @@
 from datetime import datetime
-from enum import Enum
 
 from typing import Any, Annotated
 
 from pydantic import ConfigDict, BaseModel, errors, PlainValidator, StringConstraints, PlainSerializer
 
+# Kept in `constants` so that the CLI can use them without importing pydantic
+from srcup.constants import BuildSystem, ContentEncoding, PayloadFormat  # noqa: F401
+
 
 def hex_bytes_validator(val: Any) -> bytes:
     if isinstance(val, bytes):
@@ -16,28 +18,11 @@ def hex_bytes_validator(val: Any) -> bytes:
     raise errors.BytesError()
 
 
-HexBytes = Annotated[bytes, PlainValidator(hex_bytes_validator), PlainSerializer(lambda bs: bs.hex())]
+# Hex in JSON, raw bytes in `model_dump()` so that binary payload formats can send them as is
+HexBytes = Annotated[bytes, PlainValidator(hex_bytes_validator), PlainSerializer(lambda bs: bs.hex(), when_used="json")]
 HexString = Annotated[str, StringConstraints(pattern=r"^(0x)?[0-9A-Fa-f]{2,}$"), ]
 
 
-class BuildSystem(Enum):
-    # ARCHIVE = "Archive"
-    BROWNIE = "Brownie"
-    # BUIDLER = "Buidler"
-    # DAPP = "Dapp"
-    # EMBARK = "Embark"
-    # ETHERLIME = "Etherlime"
-    # ETHERSCAN = "Etherscan"
-    HARDHAT = "Hardhat"
-    SOLC = "Solc"
-    # SOLC_STANDARD_JSON = "SolcStandardJson"
-    STANDARD = "Standard"
-    TRUFFLE = "Truffle"
-    VYPER = "Vyper"
-    # WAFFLE = "Waffle"
-    FOUNDRY = "Foundry"
-
-
 class ContractSource(BaseModel):
     # TODO[pydantic]: The following keys were removed: `json_encoders`.
     # Check https://docs.pydantic.dev/dev-v2/migration/#changes-to-config for more information.
@@ -56,6 +41,18 @@ class ContractSource(BaseModel):
     json_immutable_references: dict | None
     json_function_debug_info: dict | None
 
+
+class ContractSourceRef(ContractSource):
+    # `array_source_level` is left empty, the sources are looked up in the payload's `source_table`
+    array_source_ids: list[int]
+
+
+class SourceText(BaseModel):
+    md5_source: HexBytes
+    # None when the API already has the source (see `--delta`)
+    content: str | None
+
+
 class ProjectSource(ContractSource):
     # TODO[pydantic]: The following keys were removed: `json_encoders`.
     # Check https://docs.pydantic.dev/dev-v2/migration/#changes-to-config for more information.
@@ -0,0 +1,504 @@
+import json
+import tempfile
+import zlib
+from hashlib import md5, sha1
+from typing import Any, AsyncIterator, Collection, Iterable, Iterator, Mapping, cast
+
+from pydantic import BaseModel
+
+from srcup.models import (
+    ContentEncoding, ContractBytecode, ContractInitCode, ContractSource, ContractSourceRef, HexBytes, PayloadFormat,
+    SourceText, YulIRCode,
+)
+from srcup.profiling import add_bytes, phase
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore[assignment]
+
+try:
+    import msgpack  # type: ignore[import]
+except ImportError:
+    msgpack = None  # type: ignore[assignment]
+
+
+CHUNK_SIZE = 1 << 16
+
+# Serialized payload columns stay in memory up to this size, and are written to a temporary file beyond it
+SPOOL_MEMORY = 32 << 20
+
+MEDIA_TYPES = {
+    PayloadFormat.JSON: "application/json",
+    PayloadFormat.MSGPACK: "application/msgpack",
+}
+
+
+def _fields(model: BaseModel, exclude: set[str]) -> dict[str, Any]:
+    # Shallow field copy: unlike `model_dump` this neither serializes the bytes nor deep-copies the ABI
+    return {name: getattr(model, name) for name in type(model).model_fields if name not in exclude}
+
+
+class SourceTableBuilder:
+    """
+        Incremental `build_source_table`: turns contracts into `ContractSourceRef`s one at a time.
+    """
+
+    def __init__(self):
+        self.table: list[SourceText] = []
+        # Keyed by the content itself: contracts share the same `str` objects, so lookups are cheap
+        self.index: dict[str, int] = {}
+
+    def add(self, source: ContractSource) -> ContractSourceRef:
+        ids: list[int] = []
+        for content in source.array_source_level:
+            if (source_id := self.index.get(content)) is None:
+                source_id = self.index[content] = len(self.table)
+                self.table.append(SourceText(md5_source=HexBytes(md5(content.encode()).digest()), content=content))
+            ids.append(source_id)
+
+        return ContractSourceRef(
+            **_fields(source, exclude={"array_source_level"}),
+            array_source_level=[],
+            array_source_ids=ids,
+        )
+
+
+def build_source_table(sources: list[ContractSource]) -> tuple[list[ContractSourceRef], list[SourceText]]:
+    builder = SourceTableBuilder()
+    refs = [builder.add(source) for source in sources]
+    return refs, builder.table
+
+
+def expand_source_table(sources: list[ContractSourceRef], table: list[SourceText]) -> list[ContractSource]:
+    """
+        Inverse of `build_source_table`, rebuilds the per-contract view of the sources as the API expects it.
+    """
+    return [
+        ContractSource(
+            **_fields(source, exclude={"array_source_level", "array_source_ids"}),
+            array_source_level=[cast(str, table[i].content) for i in source.array_source_ids],
+        )
+        for source in sources
+    ]
+
+
+class PayloadSpool:
+    """
+        Holds payload entries serialized in `payload_format`, in memory up to `max_memory` bytes
+        and in a temporary file beyond it, so that only the entry being added is a live model.
+    """
+
+    def __init__(self, payload_format: PayloadFormat, max_memory: int = SPOOL_MEMORY):
+        self.payload_format = payload_format
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self.size = 0
+
+    def __enter__(self) -> "PayloadSpool":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def column(self, model: type[BaseModel]) -> "SpooledColumn":
+        return SpooledColumn(self, model)
+
+    def write(self, data: bytes) -> tuple[int, int]:
+        self.file.seek(self.size)
+        self.file.write(data)
+        offset, self.size = self.size, self.size + len(data)
+        return offset, len(data)
+
+    def read(self, offset: int, length: int) -> bytes:
+        self.file.seek(offset)
+        return self.file.read(length)
+
+
+class SpooledColumn:
+    """
+        A payload list whose entries live serialized in a `PayloadSpool`, indexed by (key, offset, length).
+        The key is the hash that identifies the entry for `--delta`.
+    """
+
+    def __init__(
+        self,
+        spool: PayloadSpool,
+        model: type[BaseModel],
+        entries: list[tuple[str, int, int]] | None = None,
+        replace: dict[str, BaseModel] | None = None,
+    ):
+        self.spool = spool
+        self.model = model
+        self.entries = entries if entries is not None else []
+        self.replace = replace or {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def append(self, item: BaseModel, key: str):
+        with phase("serialization") as p:
+            data = serialize_model(item, self.spool.payload_format)
+            p.bytes += len(data)
+        self.entries.append((key, *self.spool.write(data)))
+
+    def keys(self) -> list[str]:
+        return [key for key, _, _ in self.entries]
+
+    def filtered(self, drop: Collection[str] = frozenset(), replace: Mapping[str, BaseModel] | None = None) -> "SpooledColumn":
+        """
+            A view without the entries whose key is in `drop`, and with the ones in `replace` substituted.
+        """
+        entries = [entry for entry in self.entries if entry[0] not in drop]
+        return SpooledColumn(self.spool, self.model, entries, {**self.replace, **(replace or {})})
+
+    def sliced(self, start: int, end: int) -> "SpooledColumn":
+        return SpooledColumn(self.spool, self.model, self.entries[start:end], self.replace)
+
+    def sizes(self) -> list[int]:
+        return [length for _, _, length in self.entries]
+
+    def iter_serialized(self, payload_format: PayloadFormat) -> Iterator[bytes]:
+        for key, offset, length in self.entries:
+            if (item := self.replace.get(key)) is not None:
+                yield serialize_model(item, payload_format)
+                continue
+
+            data = self.spool.read(offset, length)
+            if payload_format != self.spool.payload_format:
+                # The API turned the spooled format down, see `DedaubClient.post_payload`
+                data = serialize_model(deserialize_model(self.model, data, self.spool.payload_format), payload_format)
+            yield data
+
+
+def serialize_model(item: BaseModel | None, payload_format: PayloadFormat) -> bytes:
+    if payload_format == PayloadFormat.MSGPACK:
+        if msgpack is None:
+            raise Exception("msgpack payloads require the `msgpack` package: pip install msgpack")
+        return msgpack.packb(item.model_dump() if item is not None else None, use_bin_type=True)
+    return item.model_dump_json().encode() if item is not None else b"null"
+
+
+def deserialize_model(model: type[BaseModel], data: bytes, payload_format: PayloadFormat) -> BaseModel | None:
+    # A nil entry stands for a contract without IR or init code, in either format
+    if payload_format == PayloadFormat.MSGPACK:
+        obj = msgpack.unpackb(data, raw=False)
+        return model.model_validate(obj) if obj is not None else None
+    return model.model_validate_json(data) if data.strip() != b"null" else None
+
+
+def present(items: list | SpooledColumn) -> list | SpooledColumn:
+    # Contracts without IR or init code have None in their place, spooled columns never hold those
+    return items if isinstance(items, SpooledColumn) else [x for x in items if x]
+
+
+# Payload lists, all of which can be sent by reference, and the hash that identifies each of their entries.
+# Contract sources (source maps, ABIs, debug info) are identified by `source_key`
+DELTA_FIELDS: dict[str, str | None] = {
+    "sources": None,
+    "bytecode": "md5_bytecode",
+    "ir_code": "codehash",
+    "init_code": "md5_bytecode",
+    "source_table": "md5_source",
+}
+
+
+def source_key(source: ContractSource, text_hashes: Iterable[bytes] | None = None) -> str:
+    """
+        Identifies a contract source for `--delta` by everything it holds, unlike its bytecode hash, which stays the
+        same when only the source text or map change (e.g. without the metadata hash). The source texts count by
+        their md5, `text_hashes` if given, so that a `ContractSourceRef` gets the key of the source it expands to.
+    """
+    digest = md5(source.model_dump_json(exclude={"array_source_level", "array_source_ids"}).encode())
+    if text_hashes is None:
+        text_hashes = (md5(content.encode()).digest() for content in source.array_source_level)
+    for text_hash in text_hashes:
+        digest.update(text_hash)
+    return digest.hexdigest()
+
+
+def entry_hashes(key: str, items: list | SpooledColumn, source_table: list[SourceText] | None = None) -> list[str]:
+    # The hashes of the entries of the `key` payload list, `source_table` resolves the texts of `ContractSourceRef`s
+    if isinstance(items, SpooledColumn):
+        return items.keys()
+    if (attr := DELTA_FIELDS[key]) is not None:
+        return [getattr(item, attr).hex() for item in items]
+    return [
+        source_key(item, [source_table[i].md5_source for i in item.array_source_ids])
+        if isinstance(item, ContractSourceRef) and source_table is not None else source_key(item)
+        for item in items
+    ]
+
+
+def hash_inventory(payload: dict[str, Any]) -> dict[str, list[str]]:
+    return {
+        key: entry_hashes(key, payload.get(key) or [], payload.get("source_table"))
+        for key in DELTA_FIELDS
+    }
+
+
+def drop_known(payload: dict[str, Any], known: dict[str, list[str]]) -> dict[str, Any]:
+    """
+        Replaces the entries the API already has with references to them.
+        Source table entries keep their position (contracts refer to them by index) but lose their content.
+    """
+    payload = dict(payload)
+    reused: dict[str, list[str]] = {}
+
+    for key in DELTA_FIELDS:
+        known_hashes = set(known.get(key) or [])
+        if not known_hashes or not payload.get(key):
+            continue
+
+        items = payload[key]
+        if key == "source_table":
+            stubs = {h: SourceText(md5_source=HexBytes(bytes.fromhex(h)), content=None) for h in known_hashes}
+            if isinstance(items, SpooledColumn):
+                payload[key] = items.filtered(replace=stubs)
+            else:
+                payload[key] = [stubs.get(item.md5_source.hex(), item) for item in items]
+            continue
+
+        hashes = entry_hashes(key, items, payload.get("source_table"))
+        if reused_hashes := [h for h in hashes if h in known_hashes]:
+            reused[key] = reused_hashes
+        if isinstance(items, SpooledColumn):
+            payload[key] = items.filtered(drop=known_hashes)
+        else:
+            payload[key] = [item for item, h in zip(items, hashes) if h not in known_hashes]
+
+    payload["reused_hashes"] = reused
+    return payload
+
+
+def split_payload(payload: dict[str, Any], max_bytes: int) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """
+        Splits a payload into its scalar fields and batches of consecutive slices of its columns, of about
+        `max_bytes` serialized bytes each. Concatenating the columns of the batches in order gives back the payload.
+        An entry larger than `max_bytes` gets a batch of its own.
+    """
+    fields = {key: value for key, value in payload.items() if key not in DELTA_FIELDS}
+    columns = {key: value for key, value in payload.items() if key in DELTA_FIELDS and value is not None}
+
+    batches: list[dict[str, Any]] = []
+    batch: dict[str, Any] = {}
+    size = 0
+    for key, items in columns.items():
+        sizes = items.sizes() if isinstance(items, SpooledColumn) else [len(item.model_dump_json()) for item in items]
+        start = 0
+        for end, item_size in enumerate(sizes):
+            if size + item_size > max_bytes and (batch or end > start):
+                if end > start:
+                    batch[key] = items.sliced(start, end) if isinstance(items, SpooledColumn) else items[start:end]
+                batches.append(batch)
+                batch, size, start = {}, 0, end
+            size += item_size
+        if len(sizes) > start:
+            batch[key] = items.sliced(start, len(sizes)) if isinstance(items, SpooledColumn) else items[start:]
+
+    if batch or not batches:
+        batches.append(batch)
+    return fields, batches
+
+
+def payload_digest(path: str, fields: dict[str, Any], batches: list[dict[str, Any]]) -> str:
+    """
+        Identifies a split payload by its fields and the hashes of the entries of each batch,
+        so that a rerun that would upload the same thing can resume the same upload session.
+    """
+    digest = sha1()
+    digest.update(json.dumps([path, fields], sort_keys=True, default=str).encode())
+    source_table = [text for batch in batches for text in batch.get("source_table") or []]
+    for batch in batches:
+        hashes = {key: entry_hashes(key, items, source_table) for key, items in batch.items()}
+        digest.update(json.dumps(hashes, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def spool_records(
+    records: Iterable[tuple[ContractSource, ContractBytecode, YulIRCode | None, ContractInitCode | None]],
+    spool: PayloadSpool,
+    dedup_sources: bool,
+) -> tuple[dict[str, Any], list[bytes]]:
+    """
+        Serializes contract records into spooled payload columns as they are extracted.
+        Returns the columns, keyed like the payload fields, and the code hashes of the contracts.
+    """
+    sources = spool.column(ContractSourceRef if dedup_sources else ContractSource)
+    bytecode = spool.column(ContractBytecode)
+    ir_code = spool.column(YulIRCode)
+    init_code = spool.column(ContractInitCode)
+    builder = SourceTableBuilder() if dedup_sources else None
+    # Source text hashes by content, contracts share the same `str` objects
+    text_cache: dict[str, bytes] = {}
+    codehashes: list[bytes] = []
+
+    for source, bytecode_item, ir_item, init_item in records:
+        if builder is not None:
+            ref = builder.add(source)
+            sources.append(ref, source_key(ref, [builder.table[i].md5_source for i in ref.array_source_ids]))
+        else:
+            text_hashes = [
+                text_cache.get(content) or text_cache.setdefault(content, md5(content.encode()).digest())
+                for content in source.array_source_level
+            ]
+            sources.append(source, source_key(source, text_hashes))
+        bytecode.append(bytecode_item, bytecode_item.md5_bytecode.hex())
+        codehashes.append(bytecode_item.codehash)
+        if ir_item is not None:
+            ir_code.append(ir_item, ir_item.codehash.hex())
+        if init_item is not None:
+            init_code.append(init_item, init_item.md5_bytecode.hex())
+
+    columns = {
+        "sources": sources,
+        "bytecode": bytecode,
+        "ir_code": ir_code,
+        "init_code": init_code,
+        "source_table": builder.table if builder is not None else None,
+    }
+    return columns, codehashes
+
+
+def _encode_value(value: Any) -> Iterator[bytes]:
+    if isinstance(value, BaseModel):
+        yield value.model_dump_json().encode()
+    elif isinstance(value, (list, tuple)):
+        yield b"["
+        for i, item in enumerate(value):
+            if i:
+                yield b","
+            yield from _encode_value(item)
+        yield b"]"
+    elif isinstance(value, SpooledColumn):
+        yield b"["
+        for i, data in enumerate(value.iter_serialized(PayloadFormat.JSON)):
+            if i:
+                yield b","
+            yield data
+        yield b"]"
+    else:
+        yield json.dumps(value).encode()
+
+
+def _chunks(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    # Coalesces small pieces into chunks of roughly `CHUNK_SIZE` bytes
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _json_pieces(fields: dict[str, Any]) -> Iterator[bytes]:
+    yield b"{"
+    for i, (key, value) in enumerate(fields.items()):
+        if i:
+            yield b","
+        yield json.dumps(key).encode() + b":"
+        yield from _encode_value(value)
+    yield b"}"
+
+
+def iter_json(fields: dict[str, Any]) -> Iterator[bytes]:
+    """
+        Serializes the payload one model at a time, so the whole document never has to exist as a single string.
+    """
+    return _chunks(_json_pieces(fields))
+
+
+def _pack_value(packer: Any, value: Any) -> Iterator[bytes]:
+    if isinstance(value, BaseModel):
+        # `HexBytes` fields stay raw bytes here, and are packed as msgpack binaries
+        yield packer.pack(value.model_dump())
+    elif isinstance(value, (list, tuple)):
+        yield packer.pack_array_header(len(value))
+        for item in value:
+            yield from _pack_value(packer, item)
+    elif isinstance(value, SpooledColumn):
+        yield packer.pack_array_header(len(value))
+        yield from value.iter_serialized(PayloadFormat.MSGPACK)
+    else:
+        yield packer.pack(value)
+
+
+def _msgpack_pieces(fields: dict[str, Any]) -> Iterator[bytes]:
+    packer = msgpack.Packer(use_bin_type=True)
+    yield packer.pack_map_header(len(fields))
+    for key, value in fields.items():
+        yield packer.pack(key)
+        yield from _pack_value(packer, value)
+
+
+def iter_msgpack(fields: dict[str, Any]) -> Iterator[bytes]:
+    """
+        MessagePack counterpart of `iter_json`: bytecode, hashes and selectors are sent as raw bytes instead of hex.
+    """
+    if msgpack is None:
+        raise Exception("msgpack payloads require the `msgpack` package: pip install msgpack")
+    return _chunks(_msgpack_pieces(fields))
+
+
+def serialize(fields: dict[str, Any], payload_format: PayloadFormat) -> Iterator[bytes]:
+    if payload_format == PayloadFormat.MSGPACK:
+        return iter_msgpack(fields)
+    return iter_json(fields)
+
+
+def compress(chunks: Iterable[bytes], encoding: ContentEncoding) -> Iterator[bytes]:
+    if encoding == ContentEncoding.IDENTITY:
+        yield from chunks
+        return
+
+    if encoding == ContentEncoding.GZIP:
+        compressor: Any = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif zstandard is not None:
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        raise Exception("zstd encoding requires the `zstandard` package: pip install zstandard")
+
+    for chunk in chunks:
+        if out := compressor.compress(chunk):
+            yield out
+    yield compressor.flush()
+
+
+def payload_headers(encoding: ContentEncoding, payload_format: PayloadFormat = PayloadFormat.JSON) -> dict[str, str]:
+    headers = {"Content-Type": MEDIA_TYPES[payload_format]}
+    if encoding != ContentEncoding.IDENTITY:
+        headers["Content-Encoding"] = encoding.value
+    return headers
+
+
+async def stream_payload(
+    fields: dict[str, Any], encoding: ContentEncoding, payload_format: PayloadFormat = PayloadFormat.JSON
+) -> AsyncIterator[bytes]:
+    # aiohttp sends async iterables with chunked transfer encoding
+    for chunk in compress(serialize(fields, payload_format), encoding):
+        add_bytes(len(chunk))
+        yield chunk
+
+
+def decode_payload(body: bytes, content_type: str, content_encoding: str | None = None) -> dict[str, Any]:
+    """
+        Inverse of `stream_payload`, for testing against a local stand-in of the API.
+        Binary formats leave the `HexBytes` fields as bytes, which the models accept as well as hex.
+    """
+    if content_encoding == ContentEncoding.GZIP.value:
+        body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif content_encoding == ContentEncoding.ZSTD.value:
+        if zstandard is None:
+            raise Exception("zstd encoding requires the `zstandard` package: pip install zstandard")
+        # Streamed frames don't record their size, which `ZstdDecompressor.decompress` requires
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+
+    if content_type.split(";")[0].strip() == MEDIA_TYPES[PayloadFormat.MSGPACK]:
+        if msgpack is None:
+            raise Exception("msgpack payloads require the `msgpack` package: pip install msgpack")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
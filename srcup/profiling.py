@@ -0,0 +1,150 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Iterator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+
+class Phase:
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = 0
+        self.max_rss = 0
+        self.bytes = 0
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "depth": self.depth,
+            "calls": self.calls,
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+            "peak_traced_bytes": self.peak,
+            "max_rss_bytes": self.max_rss,
+            "bytes": self.bytes,
+        }
+
+
+def _cpu_time() -> float:
+    # Includes the build tool and the worker processes, once they have been waited for
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _max_rss() -> int:
+    if resource is None:
+        return 0
+    # Kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Profiler:
+    """
+        Records wall time, CPU time, peak memory and byte counts of the named phases of a run.
+        Phases nest, and a phase entered several times accumulates; peak memory of a phase includes its children.
+        Only phases of the main thread are recorded.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.phases: dict[str, Phase] = {}
+        # Open phases, with the highest traced memory seen by each so far
+        self.stack: list[list[Any]] = []
+        self.trace_memory = trace_memory
+        self.start = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[Phase]:
+        key = "/".join([entry[0].name for entry in self.stack] + [name])
+        if (phase := self.phases.get(key)) is None:
+            phase = self.phases[key] = Phase(key, len(self.stack))
+
+        if self.trace_memory:
+            if self.stack:
+                self.stack[-1][1] = max(self.stack[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        entry: list[Any] = [phase, 0]
+        self.stack.append(entry)
+        wall, cpu = time.perf_counter(), _cpu_time()
+        try:
+            yield phase
+        finally:
+            phase.wall += time.perf_counter() - wall
+            phase.cpu += _cpu_time() - cpu
+            phase.calls += 1
+            phase.max_rss = max(phase.max_rss, _max_rss())
+            self.stack.pop()
+
+            if self.trace_memory:
+                peak = max(entry[1], tracemalloc.get_traced_memory()[1])
+                phase.peak = max(phase.peak, peak)
+                if self.stack:
+                    self.stack[-1][1] = max(self.stack[-1][1], peak)
+                tracemalloc.reset_peak()
+
+    def add_bytes(self, count: int):
+        if self.stack:
+            self.stack[-1][0].bytes += count
+
+    def report(self) -> str:
+        lines = [f"{'Phase':<36} {'Wall s':>9} {'CPU s':>9} {'Peak MB':>9} {'RSS MB':>9} {'MB':>9} {'Calls':>7}"]
+        for phase in self.phases.values():
+            label = "  " * phase.depth + phase.name.rsplit("/", 1)[-1]
+            lines.append(
+                f"{label:<36} {phase.wall:>9.2f} {phase.cpu:>9.2f} "
+                f"{phase.peak / 2**20 if self.trace_memory else float('nan'):>9.1f} {phase.max_rss / 2**20:>9.1f} "
+                f"{phase.bytes / 2**20:>9.2f} {phase.calls:>7}"
+            )
+        lines.append(f"{'total':<36} {time.perf_counter() - self.start:>9.2f} {_cpu_time():>9.2f}")
+        return "\n".join(lines)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "total_wall_s": round(time.perf_counter() - self.start, 6),
+            "total_cpu_s": round(_cpu_time(), 6),
+            "max_rss_bytes": _max_rss(),
+            "trace_memory": self.trace_memory,
+            "phases": [phase.to_json() for phase in self.phases.values()],
+        }
+
+    def write_json(self, path: str | os.PathLike):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+
+_profiler: Profiler | None = None
+
+
+def start(trace_memory: bool = True) -> Profiler:
+    global _profiler
+    _profiler = Profiler(trace_memory)
+    return _profiler
+
+
+def phase(name: str) -> ContextManager[Phase]:
+    """
+        Records `name` as a phase of the active profiler. Does nothing if profiling is off, or outside of the main thread.
+    """
+    if _profiler is None or threading.current_thread() is not threading.main_thread():
+        return nullcontext(Phase(name, 0))
+    return _profiler.phase(name)
+
+
+def add_bytes(count: int):
+    if _profiler is not None and threading.current_thread() is threading.main_thread():
+        _profiler.add_bytes(count)
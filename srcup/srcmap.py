@@ -0,0 +1,48 @@
+import re
+from hashlib import md5
+
+# The start of an entry up to its file id, and the file id: entries are `s:l:f:j:m`, with any field empty or omitted
+_FILE_ID = re.compile(r"((?:^|;)[^;:]*:[^;:]*:)(-?\d+)(?=[;:]|$)")
+
+SRCMAP_CACHE_SIZE = 4096
+
+_remap_cache: dict[tuple[bytes, frozenset[str]], tuple[list[str], str]] = {}
+
+
+def generate_remapping(references: list[str], file_ids: set[str] | frozenset[str]) -> dict[str, str]:
+    return {
+        v: str(k) if v in file_ids else "-1"
+        for k, v in enumerate(
+            references,
+            start=-1 if len(references) and references[0] == "-1" else 0,
+        )
+    }
+
+
+def remap_source_map(src_map: str, file_ids: frozenset[str]) -> tuple[list[str], str]:
+    """
+        Returns the file ids referenced by a compressed source map, sorted, and the source map with each of them
+        replaced by its index in that list, or -1 if it isn't one of `file_ids`.
+
+        The source map string is split around its file ids by a single regex scan, so the ids are collected and
+        rewritten without splitting every entry. Results are memoized, since the same contract is often part of
+        several compilation units.
+    """
+    key = (md5(src_map.encode()).digest(), file_ids)
+    if (cached := _remap_cache.get(key)) is not None:
+        return cached
+
+    # [text, entry prefix, file id, text, entry prefix, file id, ..., text]
+    parts = _FILE_ID.split(src_map)
+    ids = parts[2::3]
+    references = sorted(set(ids), key=int)
+    remapping = generate_remapping(references, file_ids)
+
+    if any(k != v for k, v in remapping.items()):
+        parts[2::3] = [remapping[file_id] for file_id in ids]
+        src_map = "".join(parts)
+
+    if len(_remap_cache) >= SRCMAP_CACHE_SIZE:
+        _remap_cache.clear()
+    _remap_cache[key] = references, src_map
+    return references, src_map
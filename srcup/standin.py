@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+    A local stand-in for the parts of the Dedaub API that srcup uses, to try uploads out without an account:
+
+        python -m srcup.standin --port 8080 [--fail-rate 0.2] [--max-body 8]
+        srcup --api-url http://localhost:8080 --api-key test --init ...
+
+    Projects only live in memory. Uploads are decoded and validated against the payload models, and sources sent
+    through a source table are expanded back, as the API does. `--fail-rate` fails that share of the uploads after
+    their body was received, to exercise retries and upload session resumption.
+"""
+
+import argparse
+import random
+import uuid
+from hashlib import md5
+from typing import Any
+
+from aiohttp import web
+from pydantic import ValidationError
+
+from srcup.models import ContractBytecode, ContractInitCode, ContractSource, ContractSourceRef, SourceText, YulIRCode
+from srcup.payload import DELTA_FIELDS, decode_payload, entry_hashes, expand_source_table, source_key
+
+
+class Project:
+    def __init__(self, project_id: int, name: str, owner: str):
+        self.project_id = project_id
+        self.name = name
+        self.owner = owner
+        self.versions: list[dict[str, Any]] = []
+        # Hashes of everything uploaded to the project so far, per `DELTA_FIELDS` list
+        self.hashes: dict[str, set[str]] = {key: set() for key in DELTA_FIELDS}
+        self.sources: dict[str, str] = {}
+        # Contract sources by `source_key`, what a version that reuses them is made of
+        self.contracts: dict[str, ContractSource] = {}
+
+
+class StandIn:
+    def __init__(self, fail_rate: float = 0.0, seed: int | None = None):
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.projects: dict[int, Project] = {}
+        self.sessions: dict[str, dict[str, Any]] = {}
+        # (method, path, body size) of every request with a body, in the order they were received
+        self.requests: list[tuple[str, str, int]] = []
+
+    def project(self, project_id: int) -> Project:
+        if (project := self.projects.get(project_id)) is None:
+            raise web.HTTPNotFound(text=f"No project with id {project_id}")
+        return project
+
+    def store(self, project: Project, payload: dict[str, Any]) -> int:
+        """
+            Validates an upload and records it as a new version of `project`. Returns the version number.
+        """
+        try:
+            table: list[SourceText] = [SourceText.model_validate(item) for item in payload.get("source_table") or []]
+            for text in table:
+                if text.content is None and (content := project.sources.get(text.md5_source.hex())) is not None:
+                    text.content = content
+                elif text.content is None:
+                    raise web.HTTPBadRequest(text=f"Unknown source {text.md5_source.hex()}")
+
+            if table:
+                refs: list[ContractSourceRef] = [ContractSourceRef.model_validate(item) for item in payload["sources"]]
+                if any(i >= len(table) for ref in refs for i in ref.array_source_ids):
+                    raise web.HTTPBadRequest(text="Source id out of the source table")
+                sources = expand_source_table(refs, table)
+            else:
+                sources = [ContractSource.model_validate(item) for item in payload["sources"]]
+
+            columns = {
+                "bytecode": [ContractBytecode.model_validate(item) for item in payload.get("bytecode") or []],
+                "ir_code": [YulIRCode.model_validate(item) for item in payload.get("ir_code") or []],
+                "init_code": [ContractInitCode.model_validate(item) for item in payload.get("init_code") or []],
+            }
+        except (ValidationError, KeyError, TypeError) as e:
+            raise web.HTTPBadRequest(text=f"Invalid payload: {e}")
+
+        for key, hashes in (payload.get("reused_hashes") or {}).items():
+            if unknown := set(hashes) - project.hashes.get(key, set()):
+                raise web.HTTPBadRequest(text=f"Reused {key} the project doesn't have: {sorted(unknown)[:3]}")
+
+        sources += [project.contracts[h] for h in (payload.get("reused_hashes") or {}).get("sources", [])]
+        for key, items in columns.items():
+            project.hashes[key].update(entry_hashes(key, items))
+        for source in sources:
+            project.contracts[key := source_key(source)] = source
+            project.hashes["sources"].add(key)
+            for content in source.array_source_level:
+                digest = md5(content.encode()).hexdigest()
+                project.sources[digest] = content
+                project.hashes["source_table"].add(digest)
+
+        project.versions.append({
+            "comment": payload.get("comment"),
+            "git_hash": payload.get("git_hash"),
+            "metadata": payload.get("metadata"),
+            "contracts": len(sources),
+            "bytecode": len(columns["bytecode"]),
+        })
+        return len(project.versions)
+
+    def create(self, payload: dict[str, Any]) -> list[int]:
+        if any(p.name == payload.get("name") for p in self.projects.values()):
+            raise web.HTTPBadRequest(text=f"Project with name {payload.get('name')} already exists")
+        project = Project(len(self.projects) + 1, payload.get("name") or "", str(payload.get("entity_id") or ""))
+        version = self.store(project, payload)
+        self.projects[project.project_id] = project
+        return [project.project_id, version]
+
+    def dispatch(self, path: str, payload: dict[str, Any]) -> Any:
+        # What an upload session commits to, see `DedaubClient.upload_session`
+        parts = path.strip("/").split("/")
+        if parts == ["project"]:
+            return self.create(payload)
+        if len(parts) == 3 and parts[0] == "project" and parts[1].isdigit() and parts[2] == "version":
+            return self.store(self.project(int(parts[1])), payload)
+        raise web.HTTPBadRequest(text=f"Uploads can't be sent to {path}")
+
+
+async def read_payload(request: web.Request) -> dict[str, Any]:
+    try:
+        return decode_payload(await request.read(), request.content_type, request.headers.get("Content-Encoding"))
+    except Exception as e:
+        raise web.HTTPBadRequest(text=f"Undecodable payload: {e}")
+
+
+def make_app(fail_rate: float = 0.0, max_body: int | None = None, seed: int | None = None) -> web.Application:
+    """
+        Builds the stand-in application. Bodies larger than `max_body` bytes are turned down with HTTP 413.
+    """
+    standin = StandIn(fail_rate, seed)
+    routes = web.RouteTableDef()
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        if "x-api-key" not in request.headers:
+            raise web.HTTPUnauthorized(text="Missing API key")
+        if request.can_read_body:
+            standin.requests.append((request.method, request.path, len(await request.read())))
+        if request.method == "PUT" or request.path == "/project" or request.path.endswith("/version"):
+            # Uploads fail after their body was received, like a connection dropped while waiting for the answer
+            await request.read()
+            if standin.random.random() < standin.fail_rate:
+                raise web.HTTPServiceUnavailable(text="Injected failure")
+        return await handler(request)
+
+    @routes.get("/project/exists/{name}")
+    async def exists(request: web.Request):
+        for project in standin.projects.values():
+            if project.name == request.match_info["name"]:
+                return web.json_response(project.project_id)
+        raise web.HTTPNotFound()
+
+    @routes.get("/entity/{name}")
+    async def entity(request: web.Request):
+        return web.json_response({"entity_id": int(md5(request.match_info["name"].encode()).hexdigest()[:6], 16)})
+
+    @routes.post("/project")
+    async def create(request: web.Request):
+        return web.json_response(standin.create(await read_payload(request)))
+
+    @routes.post("/project/{project_id:\\d+}/version")
+    async def version(request: web.Request):
+        project = standin.project(int(request.match_info["project_id"]))
+        return web.json_response(standin.store(project, await read_payload(request)))
+
+    @routes.post("/project/{project_id:\\d+}/known-hashes")
+    async def known_hashes(request: web.Request):
+        project = standin.project(int(request.match_info["project_id"]))
+        inventory = await request.json()
+        return web.json_response({
+            key: [h for h in hashes if h in project.hashes.get(key, set())] for key, hashes in inventory.items()
+        })
+
+    @routes.post("/upload-session")
+    async def open_session(request: web.Request):
+        spec = await request.json()
+        session_id = uuid.uuid4().hex
+        standin.sessions[session_id] = {**spec, "received": {}, "result": None}
+        return web.json_response({"session_id": session_id})
+
+    def session(request: web.Request) -> dict[str, Any]:
+        if (session := standin.sessions.get(request.match_info["session_id"])) is None:
+            raise web.HTTPNotFound(text="Unknown upload session")
+        return session
+
+    @routes.get("/upload-session/{session_id}")
+    async def session_status(request: web.Request):
+        current = session(request)
+        return web.json_response({"received": sorted(current["received"]), "batches": current["batches"]})
+
+    @routes.put("/upload-session/{session_id}/batch/{index:\\d+}")
+    async def batch(request: web.Request):
+        current = session(request)
+        index = int(request.match_info["index"])
+        if index >= current["batches"]:
+            raise web.HTTPBadRequest(text=f"The session has {current['batches']} batches")
+        current["received"][index] = await read_payload(request)
+        return web.json_response({})
+
+    @routes.post("/upload-session/{session_id}/commit")
+    async def commit(request: web.Request):
+        current = session(request)
+        # Committing again answers the same, in case the first answer got lost
+        if current["result"] is None:
+            if missing := [i for i in range(current["batches"]) if i not in current["received"]]:
+                raise web.HTTPConflict(text=f"Missing batches {missing}")
+            payload = dict(current["fields"])
+            for key in current["columns"]:
+                payload[key] = [item for i in range(current["batches"]) for item in current["received"][i].get(key, [])]
+            current["result"] = standin.dispatch(current["path"], payload)
+            current["received"].clear()
+        return web.json_response(current["result"])
+
+    # Bodies are decompressed by `decode_payload`, aiohttp itself only supports some of the encodings
+    app = web.Application(
+        middlewares=[middleware], client_max_size=max_body or 1 << 40, handler_args={"auto_decompress": False}
+    )
+    app.add_routes(routes)
+    app["standin"] = standin
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Dedaub API")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of the uploads to fail with HTTP 503")
+    parser.add_argument("--max-body", type=int, help="Turn down request bodies larger than this many MB")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    web.run_app(
+        make_app(args.fail_rate, args.max_body * 1024 * 1024 if args.max_body else None, args.seed),
+        host=args.host,
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
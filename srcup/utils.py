@@ -1,21 +1,60 @@
-import asyncio
-from packaging import version
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import weakref
 from pathlib import Path
 from typer import Exit
 
 import re
 import importlib.metadata
-import dotenv
-import aiohttp
 
 CONFIG_PATH = Path.home() / ".config" / "dedaub"
 __version__ = importlib.metadata.version('srcup')
 
+VERSION_CACHE_PATH = CONFIG_PATH / "latest_version.json"
+VERSION_CHECK_TTL = 24 * 60 * 60
+VERSION_CHECK_TIMEOUT = 5
+
+_version_check: dict = {}
+
+# Background threads of srcup that a forked extraction worker can do without, see `can_fork`
+_helper_threads: "weakref.WeakSet[threading.Thread]" = weakref.WeakSet()
+
 def create_config_dir():
     CONFIG_PATH.mkdir(parents=True, exist_ok=True)
 
 
+def start_helper_thread(target, name: str) -> threading.Thread:
+    """
+        Starts a daemon thread for background work that extraction doesn't depend on (the version check, the
+        archive export), which doesn't keep `can_fork` from forking extraction workers.
+    """
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    _helper_threads.add(thread)
+    thread.start()
+    return thread
+
+
+def can_fork() -> bool:
+    """
+        Whether worker processes can be forked safely. A forked child only gets a copy of the calling thread,
+        so locks held by any other thread at that moment (logging, sockets, shared state) stay held forever in the
+        child. `srcup multi` and `srcup watch` extract from worker threads. The helper threads of
+        `start_helper_thread` don't count: they only touch what the extraction workers never use.
+    """
+    return (
+        "fork" in multiprocessing.get_all_start_methods()
+        and threading.current_thread() is threading.main_thread()
+        and all(thread is threading.main_thread() or thread in _helper_threads for thread in threading.enumerate())
+    )
+
+
 def load_envfile():
+    import dotenv
+
     dotenv.load_dotenv(CONFIG_PATH / "credentials")
 
 
@@ -26,8 +65,10 @@ def version_callback(show_version: bool):
 
 
 async def get_latest_app_version() -> str:
+    import aiohttp
+
     async with aiohttp.ClientSession(
-        headers={'Accept': 'application/vnd.github.v3+json'}, json_serialize=lambda x: x.json()
+        headers={'Accept': 'application/vnd.github.v3+json'}, timeout=aiohttp.ClientTimeout(total=VERSION_CHECK_TIMEOUT)
     ) as session:
         url = 'https://api.github.com/repos/Dedaub/srcup/tags'
 
@@ -39,13 +80,70 @@ async def get_latest_app_version() -> str:
                 return re.sub('[^0-9.]', '', data[0]['name'])
         return ''
 
+
+def _read_version_cache() -> dict | None:
+    try:
+        with open(VERSION_CACHE_PATH) as f:
+            cached = json.load(f)
+        if time.time() - cached["checked_at"] < VERSION_CHECK_TTL:
+            return cached
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _fetch_latest_app_version():
+    if (cached := _read_version_cache()) is not None:
+        _version_check["latest"] = cached["latest"]
+        return
+
+    import asyncio
+
+    try:
+        latest = asyncio.run(get_latest_app_version())
+    except Exception:
+        latest = ''
+
+    _version_check["latest"] = latest
+    _version_check["fetched"] = True
+    try:
+        # Failures are cached too, so that restricted networks don't pay for the timeout on every run
+        with open(VERSION_CACHE_PATH, "w") as f:
+            json.dump({"latest": latest, "checked_at": time.time()}, f)
+    except OSError:
+        pass
+
+
+def start_version_check():
+    """
+        Looks up the latest release in the background, the result is reported by `check_version` once srcup is done.
+        Set SRCUP_NO_VERSION_CHECK=1 to disable the check.
+    """
+    if os.environ.get("SRCUP_NO_VERSION_CHECK", "").lower() in ("1", "true", "yes"):
+        return
+
+    _version_check["thread"] = start_helper_thread(_fetch_latest_app_version, "srcup-version-check")
+
+
 def check_version():
-    latest_app_version = asyncio.run(get_latest_app_version())
+    from packaging import version
+
+    if (thread := _version_check.get("thread")) is None:
+        return
+
+    # Never hold up the exit for it
+    thread.join(timeout=0.1)
+    if thread.is_alive():
+        return
+
+    # On stderr: it comes after the output of the command, whose last line scripts may read
+    latest_app_version = _version_check.get("latest")
     if not latest_app_version:
-        print("Warning: Failed to retrieve information about the latest release")
+        if _version_check.get("fetched"):
+            print("Warning: Failed to retrieve information about the latest release", file=sys.stderr)
 
     elif version.parse(__version__) < version.parse(latest_app_version):
-        print(f"Warning: A new version is available ({latest_app_version})\n")
-        print("It's recommended that you upgrade to the latest version to get the latest features and bugfixes:")
-        print("  For pipx installation run:      pipx upgrade srcup")
-        print("  For plain pip installation run: pip install --upgrade git+https://github.com/Dedaub/srcup#egg=srcup")
+        print(f"Warning: A new version is available ({latest_app_version})\n", file=sys.stderr)
+        print("It's recommended that you upgrade to the latest version to get the latest features and bugfixes:", file=sys.stderr)
+        print("  For pipx installation run:      pipx upgrade srcup", file=sys.stderr)
+        print("  For plain pip installation run: pip install --upgrade git+https://github.com/Dedaub/srcup#egg=srcup", file=sys.stderr)
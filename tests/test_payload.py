@@ -0,0 +1,89 @@
+import pytest
+
+from srcup.models import ContractBytecode, ContractSource, HexBytes, PayloadFormat
+from srcup.payload import (
+    PayloadSpool,
+    SpooledColumn,
+    build_source_table,
+    drop_known,
+    expand_source_table,
+    hash_inventory,
+    source_key,
+    spool_records,
+)
+
+
+def contract(text: str, source_map: str) -> tuple[ContractSource, ContractBytecode]:
+    # The bytecode stays the same whatever the source, as it does when the metadata hash is left out
+    source = ContractSource(
+        md5_bytecode=HexBytes(b"\1" * 16),
+        contract_name="C",
+        contract_path="C.sol",
+        array_source_level=[text],
+        array_source_names=["C.sol"],
+        source_map=source_map,
+        json_abi=[],
+        array_function_selectors=[],
+        array_event_selectors=[],
+        array_error_selectors=[],
+        json_immutable_references=None,
+        json_function_debug_info=None,
+    )
+    bytecode = ContractBytecode(
+        md5_bytecode=HexBytes(b"\1" * 16), codehash=HexBytes(b"\2" * 32), bytecode=HexBytes(b"\0")
+    )
+    return source, bytecode
+
+
+OLD = contract("contract C { }", "0:15:0")
+NEW = contract("contract C { uint x; }", "0:22:0")
+
+
+def payload(record: tuple[ContractSource, ContractBytecode], dedup_sources: bool, spooled: bool) -> dict:
+    source, bytecode = record
+    if spooled:
+        columns, _ = spool_records([(source, bytecode, None, None)], PayloadSpool(PayloadFormat.JSON), dedup_sources)
+        return {key: value for key, value in columns.items() if value is not None}
+    if dedup_sources:
+        refs, table = build_source_table([source])
+        return {"sources": refs, "bytecode": [bytecode], "source_table": table}
+    return {"sources": [source], "bytecode": [bytecode]}
+
+
+def texts(payload: dict) -> list[str]:
+    sources = payload["sources"]
+    if isinstance(sources, SpooledColumn):
+        sources = [sources.model.model_validate_json(data) for data in sources.iter_serialized(PayloadFormat.JSON)]
+    if "source_table" in payload:
+        sources = expand_source_table(sources, payload["source_table"])
+    return [text for source in sources for text in source.array_source_level]
+
+
+@pytest.mark.parametrize("dedup_sources", [False, True])
+@pytest.mark.parametrize("spooled", [False, True])
+def test_keys_match_the_api(dedup_sources: bool, spooled: bool):
+    # The stand-in keys the sources it stores by `source_key` of their expanded form
+    assert hash_inventory(payload(OLD, dedup_sources, spooled))["sources"] == [source_key(OLD[0])]
+
+
+@pytest.mark.parametrize("dedup_sources", [False, True])
+@pytest.mark.parametrize("spooled", [False, True])
+def test_drop_known_keeps_edited_source(dedup_sources: bool, spooled: bool):
+    known = hash_inventory(payload(OLD, dedup_sources, spooled))
+    delta = drop_known(payload(NEW, dedup_sources, spooled), known)
+
+    assert len(delta["bytecode"]) == 0
+    assert len(delta["sources"]) == 1
+    assert delta["reused_hashes"] == {"bytecode": [NEW[1].md5_bytecode.hex()]}
+
+    assert texts(delta) == NEW[0].array_source_level
+
+
+@pytest.mark.parametrize("dedup_sources", [False, True])
+@pytest.mark.parametrize("spooled", [False, True])
+def test_drop_known_drops_unchanged_source(dedup_sources: bool, spooled: bool):
+    known = hash_inventory(payload(OLD, dedup_sources, spooled))
+    delta = drop_known(payload(OLD, dedup_sources, spooled), known)
+
+    assert len(delta["sources"]) == 0
+    assert delta["reused_hashes"]["sources"] == [source_key(OLD[0])]
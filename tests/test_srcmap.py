@@ -0,0 +1,50 @@
+import pytest
+
+from srcup import srcmap
+from srcup.extract import generate_remapping, get_referenced_sources, remap_srcmap
+
+
+def split_join(src_map: str, file_ids: frozenset[str]) -> tuple[list[str], str]:
+    entries = src_map.split(";")
+    references = get_referenced_sources(entries)
+    return references, ";".join(remap_srcmap(entries, generate_remapping(references, file_ids)))
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    srcmap._remap_cache.clear()
+
+
+@pytest.mark.parametrize(
+    "src_map",
+    [
+        "",
+        "0:10:0:-:0",
+        # Empty entries inherit every field of the previous one
+        "0:10:0:-:0;;;;5:3:1",
+        # Entries that only set their offset or length inherit the file id
+        "0:10:2:-:0;12;:4;::;13:1::i",
+        # Generated code, and ids that aren't part of the compilation unit
+        "0:10:-1:-:0;5:2:3;;7:1:-1:o:1;0:0:0",
+        # Fields after the file id only
+        "1:2:1;:::o;::::2;3:4:1:i:0",
+        # Multi-digit ids, and ids that are a prefix of one another
+        "0:1:1;0:1:10;0:1:11;0:1:101;0:1:-1;0:1:1",
+    ],
+)
+@pytest.mark.parametrize("file_ids", [frozenset(), frozenset({"0", "1"}), frozenset({"0", "1", "2", "3", "10", "101"})])
+def test_matches_split_join(src_map: str, file_ids: frozenset[str]):
+    assert srcmap.remap_source_map(src_map, file_ids) == split_join(src_map, file_ids)
+
+
+def test_minus_one_is_kept_first():
+    references, remapped = srcmap.remap_source_map("0:1:-1;0:1:4;0:1:7", frozenset({"4", "7"}))
+    assert references == ["-1", "4", "7"]
+    assert remapped == "0:1:-1;0:1:0;0:1:1"
+
+
+def test_memoized_per_file_ids():
+    src_map = "0:1:3;0:1:5"
+    assert srcmap.remap_source_map(src_map, frozenset({"3", "5"})) == (["3", "5"], "0:1:0;0:1:1")
+    assert srcmap.remap_source_map(src_map, frozenset({"5"})) == (["3", "5"], "0:1:-1;0:1:1")
+    assert len(srcmap._remap_cache) == 2
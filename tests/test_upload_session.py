@@ -0,0 +1,99 @@
+import asyncio
+from pathlib import Path
+from typing import cast
+
+import pytest
+from aiohttp import web
+
+from srcup.api import DedaubClient
+from srcup.models import ContractBytecode, ContractSource, HexBytes
+from srcup.payload import build_source_table
+from srcup.standin import StandIn, make_app
+
+BATCH_SIZE = 4096
+
+
+class FailingUploads:
+    # Stands in for `StandIn.random`, to fail the uploads at the given positions instead of random ones
+    def __init__(self, positions: set[int]):
+        self.positions = positions
+        self.count = 0
+
+    def random(self) -> float:
+        self.count += 1
+        return 0.0 if self.count - 1 in self.positions else 1.0
+
+
+def contracts(count: int) -> tuple[list[ContractSource], list[ContractBytecode]]:
+    sources, bytecode = [], []
+    for i in range(count):
+        md5_bytecode = HexBytes(i.to_bytes(16, "big"))
+        text = f"contract C{i} {{ }}\n" + "// padding\n" * 100
+        sources.append(ContractSource(
+            md5_bytecode=md5_bytecode,
+            contract_name=f"C{i}",
+            contract_path=f"C{i}.sol",
+            array_source_level=[text],
+            array_source_names=[f"C{i}.sol"],
+            source_map=f"0:{len(text)}:0",
+            json_abi=[],
+            array_function_selectors=[],
+            array_event_selectors=[],
+            array_error_selectors=[],
+            json_immutable_references=None,
+            json_function_debug_info=None,
+        ))
+        bytecode.append(ContractBytecode(
+            md5_bytecode=md5_bytecode, codehash=HexBytes(b"\2" * 32), bytecode=HexBytes(b"\0" * 512)
+        ))
+    return sources, bytecode
+
+
+sources, bytecode = contracts(20)
+
+
+async def upload(url: str, session_dir: Path) -> tuple[int, int]:
+    client = DedaubClient(url, "test", retries=0, batch_size=BATCH_SIZE, batch_jobs=1, session_dir=session_dir)
+    async with client:
+        refs, table = build_source_table(sources)
+        return await client.create_project(
+            "p", "", cast(list[ContractSource], refs), bytecode, [], [], "ab" * 20, "", None, {}, table
+        )
+
+
+async def resume_after_partial_upload(session_dir: Path):
+    app = make_app(fail_rate=0.5)
+    standin: StandIn = app["standin"]
+    standin.random = FailingUploads({1, 3})  # type: ignore[assignment]
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", 0).start()
+    url = f"http://localhost:{runner.addresses[0][1]}"
+    try:
+        with pytest.raises(Exception, match="2/.* batches failed to upload"):
+            await upload(url, session_dir)
+
+        (session,) = standin.sessions.values()
+        missing = set(range(session["batches"])) - set(session["received"])
+        assert len(missing) == 2 and session["batches"] > 2
+        assert len(list(session_dir.glob("*.json"))) == 1
+
+        standin.requests.clear()
+        standin.fail_rate = 0
+        assert await upload(url, session_dir) == [1, 1]
+    finally:
+        await runner.cleanup()
+
+    # Only the missing batches are sent again, in the same session
+    assert len(standin.sessions) == 1
+    assert {int(path.rsplit("/", 1)[1]) for method, path, _ in standin.requests if method == "PUT"} == missing
+    assert not list(session_dir.glob("*.json"))
+
+    project = standin.projects[1]
+    assert project.versions[0]["contracts"] == len(sources)
+    assert project.versions[0]["bytecode"] == len(bytecode)
+
+
+def test_resumes_after_partial_upload(tmp_path: Path):
+    asyncio.run(resume_after_partial_upload(tmp_path))